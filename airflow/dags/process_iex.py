@@ -30,46 +30,33 @@ def download_tops_pcap() -> str:
     )
 
 
-@task.bash
-def decompress_tops_pcap() -> str:
-    return "gunzip /tank/iex/pcap/{{ ds_nodash }}_IEXTP1_TOPS1.6.pcap.gz"
-
-
 @task.bash
 def recompress_top_pcap() -> str:
+    # the archive copy, piped so the uncompressed pcap never lands on disk. The conversion does not wait for it.
     return (
-        "zstd --compress -20 --ultra --force "
-        "-o /tank/iex/pcap/{{ ds_nodash }}_IEXTP1_TOPS1.6.pcap.zst "
-        "/tank/iex/pcap/{{ ds_nodash }}_IEXTP1_TOPS1.6.pcap"
+        "gzip --decompress --stdout /tank/iex/pcap/{{ ds_nodash }}_IEXTP1_TOPS1.6.pcap.gz "
+        "| zstd --compress -20 --ultra --force "
+        "-o /tank/iex/pcap/{{ ds_nodash }}_IEXTP1_TOPS1.6.pcap.zst"
     )
 
 
 @task.bash
 def delete_original_source() -> str:
-    return "rm /tank/iex/pcap/{{ ds_nodash }}_IEXTP1_TOPS1.6.pcap"
+    return "rm /tank/iex/pcap/{{ ds_nodash }}_IEXTP1_TOPS1.6.pcap.gz"
 
 
 @task.bash
-def convert_pcap_to_raw() -> str:
+def convert_pcap_to_h5() -> str:
     return (
-        "ulimit -n 65536 && convert-pcap "
-        "--input-path /tank/iex/pcap/{{ ds_nodash }}_IEXTP1_TOPS1.6.pcap.zst "
-        "--output-path /tank/iex/raw/{{ ds_nodash }}/"
+        "python /tank/git/iex-tools/scripts/randoms/pcap_to_h5.py "
+        "-i /tank/iex/pcap/{{ ds_nodash }}_IEXTP1_TOPS1.6.pcap.gz "
+        "-o /tank/iex/h5/{{ ds_nodash }}.h5 --catalog /tank/iex/h5/catalog.db"
     )
 
 
 @task.bash
-def convert_raw_to_h5() -> str:
-    return (
-        "python /tank/git/iex-tools/scripts/randoms/gen_h5.py "
-        "-i /tank/iex/raw/{{ ds_nodash }}/ "
-        "-o /tank/iex/h5/{{ ds_nodash }}.h5"
-    )
-
-
-@task.bash
-def delete_raw_folder() -> str:
-    return "rm -rf /tank/iex/raw/{{ ds_nodash }}"
+def export_h5_to_parquet() -> str:
+    return "python /tank/git/iex-tools/scripts/randoms/export_parquet.py -i /tank/iex/h5/{{ ds_nodash }}.h5 -o /tank/iex/parquet"
 
 
 with DAG(
@@ -139,12 +126,8 @@ with DAG(
     #     skip_on_exit_code=None,
     # )
 
-    (
-        download_tops_pcap()
-        >> decompress_tops_pcap()
-        >> recompress_top_pcap()
-        >> convert_pcap_to_raw()
-        >> convert_raw_to_h5()
-        >> delete_raw_folder()
-        >> delete_original_source()
-    )
+    # the download is read twice: streamed into the conversion, and recompressed into the archive copy.
+    downloaded = download_tops_pcap()
+    converted = downloaded >> convert_pcap_to_h5() >> export_h5_to_parquet()
+    archived = downloaded >> recompress_top_pcap()
+    [converted, archived] >> delete_original_source()
@@ -34,9 +34,172 @@ def parse__{struct_name}(buffer: np.ndarray):
     return header, remaining
 '''.strip()
 
+    # build the offset-based variant, reading every field in place.
+    field_reads = []
+    field_defaults = []
+    field_offset = 0
+    for member in members:
+        field_type = member['type']
+        if 'length' in member:
+            length = member['length']
+            field_reads.append(f'        buffer[offset + {field_offset}:offset + {field_offset + compute_field_size(field_type, length)}],')
+            field_defaults.append('buffer[:0]')
+            field_offset += compute_field_size(field_type, length)
+        else:
+            field_reads.append(f'        read__{field_type[1:]}(buffer, offset + {field_offset}),')
+            field_defaults.append(f'{convert_field_type_to_numpy_type(field_type)}(0)')
+            field_offset += compute_field_size(field_type)
+    parse_at_function_code = f'''
+@numba.njit(cache=False)
+def parse__{struct_name}_at(buffer: np.ndarray, offset: int):
+    if offset < 0 or offset + itemsize__{struct_name} > len(buffer):
+        return PARSE_END, ({", ".join(field_defaults)},)
+    return offset + itemsize__{struct_name}, (
+'''.strip() + "\n" + "\n".join(field_reads) + "\n    )"
+
     # combine all parts.
     # full_code = f"{dtype_code}\n\n{itemsize_code}\n\n{parse_function_code}"
-    return dtype_code, itemsize_code, parse_function_code
+    return dtype_code, itemsize_code, parse_function_code, parse_at_function_code
+
+
+def generate_numpy_readers() -> str:
+    """
+    Generate the little-endian scalar readers shared by the `parse__X_at` functions.
+
+    The bytes are assembled one at a time in the unsigned type of the field's width and the result is cast
+    to the field's type, so a read neither depends on the alignment of `offset` nor goes through a view.
+    `PARSE_END` is returned in place of the next offset when the buffer does not hold the whole struct.
+    """
+    readers = []
+    for field_type in ['<u1', '<u2', '<u4', '<u8', '<i1', '<i2', '<i4', '<i8']:
+        numpy_type = convert_field_type_to_numpy_type(field_type)
+        unsigned_type = convert_field_type_to_numpy_type(f'<u{field_type[2:]}')
+        byte_reads = [f'{unsigned_type}(buffer[offset])'] + [
+            f'({unsigned_type}(buffer[offset + {i}]) << {unsigned_type}({8 * i}))'
+            for i in range(1, compute_field_size(field_type))
+        ]
+        value = "\n        | ".join(byte_reads)
+        readers.append(f'''
+@numba.njit(cache=False)
+def read__{field_type[1:]}(buffer: np.ndarray, offset: int):
+    return {numpy_type}(
+        {value}
+    )
+'''.strip())
+    return "PARSE_END = -1\n\n\n" + "\n\n\n".join(readers)
+
+
+def generate_numpy_demux(input_paths: typing.List[str]) -> str:
+    """
+    Generate the numba kernel that splits IEX-TP packets into one byte buffer per message type.
+
+    Every struct with a `message_type` key is a TOPS message. The kernel walks the MessageBlockHeader
+    chain of each packet, dispatches on the message type byte and copies the message into a growable
+    buffer that is later viewed as the matching `dtype__X`. `demux_messages` wraps the kernel and
+    returns a dict of struct name to typed array. The `message_*` lookup tables map a type byte to
+    its position in `message_names` for kernels that cannot branch per type.
+
+    Parameters:
+      input_paths: Paths to the YAML files with the struct definitions.
+    """
+    definitions = {}
+    for input_path in input_paths:
+        with open(input_path, 'r') as f:
+            definition = yaml.safe_load(f)
+        definitions[definition['name']] = definition
+
+    message_names = sorted([name for name, definition in definitions.items() if 'message_type' in definition])
+    tp_members = [member['name'] for member in definitions['TransportProtocolHeader']['member']]
+    message_count_index = tp_members.index('message_count')
+
+    message_type_code = "\n".join([
+        f"message_type__{name} = {ord(definitions[name]['message_type'])}"
+        for name in message_names
+    ])
+
+    # lookup tables for kernels that index the per-type outputs instead of branching on the type.
+    message_table_code = "\n".join(
+        ["message_names = ("]
+        + [f'    "{name}",' for name in message_names]
+        + [")", "message_dtypes = ("]
+        + [f"    dtype__{name}," for name in message_names]
+        + [")", "message_itemsize__by_index = np.array(["]
+        + [f"    itemsize__{name}," for name in message_names]
+        + ["], dtype=np.int64)", "message_index__by_type = np.full(256, -1, dtype=np.int64)"]
+        + [f"message_index__by_type[message_type__{name}] = {i}" for i, name in enumerate(message_names)]
+    )
+
+    grow_function_code = '''
+@numba.njit(cache=False)
+def grow__messages(data: np.ndarray, count: int, itemsize: int) -> np.ndarray:
+    if (count + 1) * itemsize <= len(data):
+        return data
+    grown = np.empty(max(2 * len(data), (count + 1) * itemsize), dtype=np.uint8)
+    grown[:count * itemsize] = data[:count * itemsize]
+    return grown
+'''.strip()
+
+    allocations = []
+    dispatches = []
+    results = []
+    wrapper_results = []
+    for i, name in enumerate(message_names):
+        allocations.append(f"    data__{name} = np.empty(initial_capacity * itemsize__{name}, dtype=np.uint8)")
+        allocations.append(f"    count__{name} = 0")
+        keyword = "if" if i == 0 else "elif"
+        dispatches.append(f'''
+            {keyword} message_type == message_type__{name} and message_length >= itemsize__{name}:
+                data__{name} = grow__messages(data__{name}, count__{name}, itemsize__{name})
+                data__{name}[count__{name} * itemsize__{name}:(count__{name} + 1) * itemsize__{name}] = packet_buffer[message_offset:message_offset + itemsize__{name}]
+                count__{name} += 1
+'''.strip("\n"))
+        results.append(f"        data__{name}[:count__{name} * itemsize__{name}],")
+        wrapper_results.append(f'        "{name}": data[{i}].view(dtype__{name}),')
+
+    allocations_code = "\n".join(allocations)
+    dispatches_code = "\n".join(dispatches)
+    results_code = "\n".join(results)
+    wrapper_results_code = "\n".join(wrapper_results)
+
+    demux_function_code = f'''
+@numba.njit(cache=False)
+def demux__messages(buffer: np.ndarray, payload_offsets: np.ndarray, captured_lengths: np.ndarray, initial_capacity: int):
+{allocations_code}
+
+    for i in range(len(payload_offsets)):
+        packet_end = payload_offsets[i] + captured_lengths[i]
+        packet_buffer = buffer[:packet_end]
+
+        offset, ethernet_header = parse__EthernetIIHeader_at(packet_buffer, payload_offsets[i])
+        offset, ipv4_header = parse__Ipv4Header_at(packet_buffer, offset)
+        offset, udp_header = parse__UdpHeader_at(packet_buffer, offset)
+        offset, tp_header = parse__TransportProtocolHeader_at(packet_buffer, offset)
+        if offset == PARSE_END:
+            continue
+
+        for j in range(tp_header[{message_count_index}]):
+            message_offset, (message_length,) = parse__MessageBlockHeader_at(packet_buffer, offset)
+            if message_offset == PARSE_END or message_length == 0 or message_offset + message_length > packet_end:
+                break
+            offset = message_offset + message_length
+
+            message_type = read__u1(packet_buffer, message_offset)
+{dispatches_code}
+
+    return (
+{results_code}
+    )
+'''.strip()
+
+    wrapper_function_code = f'''
+def demux_messages(buffer: np.ndarray, payload_offsets: np.ndarray, captured_lengths: np.ndarray, initial_capacity: int = 1024):
+    data = demux__messages(buffer, payload_offsets, captured_lengths, initial_capacity)
+    return {{
+{wrapper_results_code}
+    }}
+'''.strip()
+
+    return f"{message_type_code}\n\n{message_table_code}\n\n\n{grow_function_code}\n\n\n{demux_function_code}\n\n\n{wrapper_function_code}"
 
 
 def compute_field_size(field_type: str, length: int = None) -> int:
@@ -162,6 +325,27 @@ def convert_field_type_to_rust_type(field_type: str) -> str:
         raise Exception("Bad")
 
 
+def convert_field_type_to_numpy_type(field_type: str) -> str:
+    if field_type == '<u1':
+        return 'np.uint8'
+    elif field_type == '<u2':
+        return 'np.uint16'
+    elif field_type == '<u4':
+        return 'np.uint32'
+    elif field_type == '<u8':
+        return 'np.uint64'
+    elif field_type == '<i1':
+        return 'np.int8'
+    elif field_type == '<i2':
+        return 'np.int16'
+    elif field_type == '<i4':
+        return 'np.int32'
+    elif field_type == '<i8':
+        return 'np.int64'
+    else:
+        raise Exception("Bad")
+
+
 def convert_field_type_to_rust_type_arr(field_type: str, field_length: int) -> str:
     rust_field_type = convert_field_type_to_rust_type(field_type)
     return f"[{rust_field_type}; {field_length}]"
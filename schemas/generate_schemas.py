@@ -28,12 +28,16 @@ def collect_python_code_gen(input_path: str):
 
 def generate_python_code(input_path: str):
     code_gens = collect_python_code_gen(input_path)
+    input_paths = [entry.path for entry in os.scandir(input_path) if entry.is_file()]
 
     code_dtype = "\n".join([s[0] for s in code_gens])
     code_itemsize = "\n".join([s[1] for s in code_gens])
     code_parse = "\n\n".join([s[2] for s in code_gens])
+    code_readers = convert_yaml.generate_numpy_readers()
+    code_parse_at = "\n\n".join([s[3] for s in code_gens])
+    code_demux = convert_yaml.generate_numpy_demux(input_paths)
 
-    result_txt = f"import numba\nimport numpy as np\n\n{code_dtype}\n\n{code_itemsize}\n\n{code_parse}"
+    result_txt = f"import numba\nimport numpy as np\n\n{code_dtype}\n\n{code_itemsize}\n\n{code_parse}\n\n{code_readers}\n\n{code_parse_at}\n\n{code_demux}"
     print(result_txt)
 
     os.makedirs("build", exist_ok=True)
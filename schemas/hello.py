@@ -1,4 +1,8 @@
 import argparse
+import gzip
+import queue
+import threading
+import typing
 
 from build.parsers import *
 from utils import conditional
@@ -114,25 +118,291 @@ def parse_pcap(buffer: np.ndarray):
         yield ethernet_header, ipv4_header, udp_header, tp_header, packet_buffer
 
 
+PCAPNG_ENHANCED_PACKET_BLOCK_TYPE = 0x00000006
+
+
+@conditional(numba.njit(cache=False))
+def index_pcap(buffer: np.ndarray):
+    """
+    Record the payload offset, captured length and timestamp of every Enhanced Packet Block.
+
+    The first pass only hops over block headers to count the packets, the second pass fills
+    exactly sized arrays. The timestamp is the raw 64-bit EPB timestamp in the interface's
+    `if_tsresol` units (nanoseconds for the IEX captures).
+    """
+    packet_count = 0
+    offset = 0
+    while True:
+        block_offset, (block_type, block_len) = parse__PcapngHeader_at(buffer, offset)
+        if block_offset == PARSE_END:
+            break
+        assert block_len >= itemsize__PcapngHeader + 4
+        assert offset + block_len <= len(buffer)
+        if block_type == PCAPNG_ENHANCED_PACKET_BLOCK_TYPE:
+            packet_count += 1
+        offset += block_len
+
+    payload_offsets = np.empty(packet_count, dtype=np.int64)
+    captured_lengths = np.empty(packet_count, dtype=np.uint32)
+    timestamps = np.empty(packet_count, dtype=np.uint64)
+
+    packet_idx = 0
+    offset = 0
+    while True:
+        block_offset, (block_type, block_len) = parse__PcapngHeader_at(buffer, offset)
+        if block_offset == PARSE_END:
+            break
+        assert read__u4(buffer, offset + block_len - 4) == block_len
+        if block_type == PCAPNG_ENHANCED_PACKET_BLOCK_TYPE:
+            payload_offset, epb = parse__PcapngEnhancedPacketBlock_at(buffer, block_offset)
+            interface_id, timestamp_upper, timestamp_lower, captured_packet_len, original_packet_len = epb
+            assert itemsize__PcapngHeader + itemsize__PcapngEnhancedPacketBlock + captured_packet_len + 4 <= block_len
+
+            payload_offsets[packet_idx] = payload_offset
+            captured_lengths[packet_idx] = captured_packet_len
+            timestamps[packet_idx] = (np.uint64(timestamp_upper) << np.uint64(32)) | np.uint64(timestamp_lower)
+            packet_idx += 1
+        offset += block_len
+
+    return payload_offsets, captured_lengths, timestamps
+
+
 @conditional(numba.njit(cache=False))
-def numba_run(buffer):
-    gen = parse_pcap(buffer)
+def numba_run(buffer, payload_offsets, captured_lengths):
     processed = 0
-    for i in gen:
-        ethernet_header, ipv4_header, udp_header, tp_header, packet_buffer = i
-        processed += len(packet_buffer)
-        if processed % 1_000_000 == 0:
-            print(processed)
-    print(processed)
-
-
-parser = argparse.ArgumentParser()
-parser.add_argument("path", type=str)
-args = parser.parse_args()
-mmap_buffer = np.memmap(args.path, dtype=np.uint8)
-try:
-    numba_run(mmap_buffer)
-except StopIteration as e:
-    pass
-except Exception as e:
-    raise e
+    for i in range(len(payload_offsets)):
+        packet_end = payload_offsets[i] + captured_lengths[i]
+        packet_buffer = buffer[:packet_end]
+
+        offset, ethernet_header = parse__EthernetIIHeader_at(packet_buffer, payload_offsets[i])
+        offset, ipv4_header = parse__Ipv4Header_at(packet_buffer, offset)
+        offset, udp_header = parse__UdpHeader_at(packet_buffer, offset)
+        offset, tp_header = parse__TransportProtocolHeader_at(packet_buffer, offset)
+        if offset == PARSE_END:
+            continue
+
+        processed += packet_end - offset
+        if (i + 1) % 1_000_000 == 0:
+            print(i + 1, processed)
+    print(len(payload_offsets), processed)
+
+
+SEQUENCE_NUMBER_NONE = np.iinfo(np.int64).max
+
+
+@conditional(numba.njit(cache=False))
+def demux_shard(buffer, payload_offsets, captured_lengths, start, stop, rows, outputs, write):
+    """
+    Walk the message blocks of packets `start..stop` of the index.
+
+    `rows` holds the next row of every message type and is advanced per message, so with `write`
+    unset the call only counts. Returns the first message sequence number seen in the shard.
+    """
+    first_sequence_number = SEQUENCE_NUMBER_NONE
+    for i in range(start, stop):
+        packet_end = payload_offsets[i] + captured_lengths[i]
+        packet_buffer = buffer[:packet_end]
+
+        offset, ethernet_header = parse__EthernetIIHeader_at(packet_buffer, payload_offsets[i])
+        offset, ipv4_header = parse__Ipv4Header_at(packet_buffer, offset)
+        offset, udp_header = parse__UdpHeader_at(packet_buffer, offset)
+        offset, tp_header = parse__TransportProtocolHeader_at(packet_buffer, offset)
+        if offset == PARSE_END:
+            continue
+
+        (
+            version, reserved, message_protocol_id, channel_id, session_id, payload_length,
+            message_count, stream_offset, first_message_sequence_number, send_time,
+        ) = tp_header
+        if message_count > 0 and first_sequence_number == SEQUENCE_NUMBER_NONE:
+            first_sequence_number = first_message_sequence_number
+
+        for j in range(message_count):
+            message_offset, (message_length,) = parse__MessageBlockHeader_at(packet_buffer, offset)
+            if message_offset == PARSE_END or message_length == 0 or message_offset + message_length > packet_end:
+                break
+            offset = message_offset + message_length
+
+            k = message_index__by_type[read__u1(packet_buffer, message_offset)]
+            if k < 0 or message_length < message_itemsize__by_index[k]:
+                continue
+            if write:
+                itemsize = message_itemsize__by_index[k]
+                outputs[k][rows[k] * itemsize:(rows[k] + 1) * itemsize] = packet_buffer[message_offset:message_offset + itemsize]
+            rows[k] += 1
+
+    return first_sequence_number
+
+
+@conditional(numba.njit(cache=False, parallel=True))
+def count_messages_sharded(buffer, payload_offsets, captured_lengths, shard_bounds, outputs):
+    shard_count = len(shard_bounds) - 1
+    counts = np.zeros((shard_count, len(message_itemsize__by_index)), dtype=np.int64)
+    first_sequence_numbers = np.empty(shard_count, dtype=np.int64)
+    for shard in numba.prange(shard_count):
+        first_sequence_numbers[shard] = demux_shard(
+            buffer, payload_offsets, captured_lengths, shard_bounds[shard], shard_bounds[shard + 1], counts[shard], outputs, False
+        )
+    return counts, first_sequence_numbers
+
+
+@conditional(numba.njit(cache=False, parallel=True))
+def scatter_messages_sharded(buffer, payload_offsets, captured_lengths, shard_bounds, shard_rows, outputs):
+    for shard in numba.prange(len(shard_bounds) - 1):
+        rows = shard_rows[shard].copy()
+        demux_shard(buffer, payload_offsets, captured_lengths, shard_bounds[shard], shard_bounds[shard + 1], rows, outputs, True)
+
+
+def demux_messages_sharded(buffer: np.ndarray, payload_offsets: np.ndarray, captured_lengths: np.ndarray, shard_count: int):
+    """
+    Demultiplex the indexed packets on all numba threads.
+
+    The index is cut into `shard_count` runs of whole Enhanced Packet Blocks. A first parallel pass counts
+    the messages of every type per shard, the shards are then laid out in stream order by the
+    `first_message_sequence_number` of their first packet, and a second parallel pass copies each shard's
+    messages straight into its rows of the merged arrays.
+    """
+    shard_bounds = np.linspace(0, len(payload_offsets), shard_count + 1).astype(np.int64)
+    no_outputs = tuple(np.empty(0, dtype=np.uint8) for _ in message_names)
+    counts, first_sequence_numbers = count_messages_sharded(buffer, payload_offsets, captured_lengths, shard_bounds, no_outputs)
+
+    order = np.argsort(first_sequence_numbers, kind="stable")
+    shard_rows = np.zeros_like(counts)
+    shard_rows[order[1:]] = np.cumsum(counts[order], axis=0)[:-1]
+
+    totals = counts.sum(axis=0)
+    outputs = tuple(np.empty(totals[k] * message_itemsize__by_index[k], dtype=np.uint8) for k in range(len(message_names)))
+    scatter_messages_sharded(buffer, payload_offsets, captured_lengths, shard_bounds, shard_rows, outputs)
+
+    return {name: outputs[k].view(message_dtypes[k]) for k, name in enumerate(message_names)}
+
+
+def decode_pcap(buffer: np.ndarray, shard_count: int = 1):
+    payload_offsets, captured_lengths, timestamps = index_pcap(buffer)
+    if shard_count > 1:
+        return demux_messages_sharded(buffer, payload_offsets, captured_lengths, shard_count)
+    return demux_messages(buffer, payload_offsets, captured_lengths)
+
+
+PCAP_CHUNK_SIZE = 64 * 1024 * 1024
+PCAP_RING_SIZE = 4
+
+
+@conditional(numba.njit(cache=False))
+def complete_blocks_length(buffer: np.ndarray) -> int:
+    offset = 0
+    while True:
+        block_offset, (block_type, block_len) = parse__PcapngHeader_at(buffer, offset)
+        if block_offset == PARSE_END or offset + block_len > len(buffer):
+            return offset
+        assert block_len >= itemsize__PcapngHeader + 4
+        offset += block_len
+
+
+def open_pcap_stream(path: str) -> typing.BinaryIO:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".zst"):
+        import zstandard
+
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+    return open(path, "rb")
+
+
+def read_full(stream: typing.BinaryIO, buffer: np.ndarray) -> int:
+    size = 0
+    view = memoryview(buffer)
+    while size < len(buffer):
+        n = stream.readinto(view[size:])
+        if not n:
+            break
+        size += n
+    return size
+
+
+def iter_pcap_chunks(path: str, chunk_size: int = PCAP_CHUNK_SIZE, ring_size: int = PCAP_RING_SIZE) -> typing.Iterator[np.ndarray]:
+    """
+    Decompress a .pcap, .pcap.gz or .pcap.zst file into a bounded ring of chunks holding whole pcapng blocks.
+
+    A reader thread fills `ring_size` preallocated buffers of `chunk_size` bytes; the tail block that straddles
+    the end of a buffer is carried over to the start of the next one. Every yielded array is a view of a ring
+    buffer that is reused once the next chunk is requested, so copy anything that must outlive the iteration.
+    """
+    free_chunks = queue.Queue()
+    for _ in range(ring_size):
+        free_chunks.put(np.empty(chunk_size, dtype=np.uint8))
+    filled_chunks = queue.Queue()
+
+    def produce():
+        try:
+            carry = np.empty(0, dtype=np.uint8)
+            with open_pcap_stream(path) as stream:
+                while True:
+                    chunk = free_chunks.get()
+                    chunk[:len(carry)] = carry
+                    size = len(carry) + read_full(stream, chunk[len(carry):])
+                    end = complete_blocks_length(chunk[:size])
+                    if end == 0 and size == chunk_size:
+                        raise ValueError(f"pcapng block larger than the {chunk_size} bytes chunk in {path}")
+                    carry = chunk[end:size].copy()
+                    filled_chunks.put((chunk, end))
+                    if size < chunk_size:
+                        if len(carry) > 0:
+                            raise ValueError(f"truncated pcapng block at the end of {path}")
+                        break
+            filled_chunks.put(None)
+        except BaseException as e:
+            filled_chunks.put(e)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    while True:
+        item = filled_chunks.get()
+        if item is None:
+            break
+        if isinstance(item, BaseException):
+            raise item
+        chunk, end = item
+        if end > 0:
+            yield chunk[:end]
+        free_chunks.put(chunk)
+    thread.join()
+
+
+def iter_decoded_chunks(path: str, shard_count: int = 1, chunk_size: int = PCAP_CHUNK_SIZE) -> typing.Iterator[typing.Dict[str, np.ndarray]]:
+    for chunk in iter_pcap_chunks(path, chunk_size):
+        yield decode_pcap(chunk, shard_count)
+
+
+def decode_pcap_file(path: str, shard_count: int = 1) -> typing.Dict[str, np.ndarray]:
+    if not path.endswith((".gz", ".zst")):
+        return decode_pcap(np.memmap(path, dtype=np.uint8, mode="r"), shard_count)
+
+    batches = list(iter_decoded_chunks(path, shard_count))
+    return {name: np.concatenate([batch[name] for batch in batches]) for name in message_names}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", type=str)
+    parser.add_argument("--shards", type=int, default=numba.config.NUMBA_NUM_THREADS)
+    args = parser.parse_args()
+
+    if args.path.endswith((".gz", ".zst")):
+        messages = decode_pcap_file(args.path, args.shards)
+    else:
+        mmap_buffer = np.memmap(args.path, dtype=np.uint8, mode="r")
+        payload_offsets, captured_lengths, timestamps = index_pcap(mmap_buffer)
+        numba_run(mmap_buffer, payload_offsets, captured_lengths)
+
+        if args.shards > 1:
+            messages = demux_messages_sharded(mmap_buffer, payload_offsets, captured_lengths, args.shards)
+        else:
+            messages = demux_messages(mmap_buffer, payload_offsets, captured_lengths)
+
+    for name, data in messages.items():
+        print(name, len(data))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+import argparse
+import datetime
+import gzip
+import logging
+import typing
+
+from build.parsers import *
+
+# Framing every packet carries in front of its message blocks.
+PACKET_HEADER_DTYPES = (
+    dtype__PcapngHeader,
+    dtype__PcapngEnhancedPacketBlock,
+    dtype__EthernetIIHeader,
+    dtype__Ipv4Header,
+    dtype__UdpHeader,
+    dtype__TransportProtocolHeader,
+)
+PACKET_HEADER_SIZE = sum(dtype.itemsize for dtype in PACKET_HEADER_DTYPES)
+FRAME_HEADER_SIZE = itemsize__EthernetIIHeader + itemsize__Ipv4Header + itemsize__UdpHeader + itemsize__TransportProtocolHeader
+
+PCAPNG_SECTION_HEADER_BLOCK_TYPE = 0x0A0D0D0A
+PCAPNG_INTERFACE_DESCRIPTION_BLOCK_TYPE = 0x00000001
+PCAPNG_ENHANCED_PACKET_BLOCK_TYPE = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+LINKTYPE_ETHERNET = 1
+
+TOPS_MESSAGE_PROTOCOL_ID = 0x8003
+TOPS_CHANNEL_ID = 1
+TOPS_SESSION_ID = 0x44970000
+TOPS_MULTICAST_IP = (233, 215, 21, 4)
+TOPS_SOURCE_IP = (23, 226, 155, 132)
+TOPS_PORT = 10378
+
+MESSAGE_TYPE_BY_INDEX = np.empty(len(message_names), dtype=np.uint8)
+MESSAGE_TYPE_BY_INDEX[message_index__by_type[message_index__by_type >= 0]] = np.flatnonzero(message_index__by_type >= 0)
+
+DEFAULT_MIX = ["Q=0.70", "T=0.25", "P=0.01", "I=0.01", "X=0.01", "H=0.005", "O=0.005", "D=0.005", "B=0.002", "A=0.002", "S=0.001"]
+PACKETS_PER_BATCH = 65536
+
+
+def network_order_u2(values) -> np.ndarray:
+    return np.asarray(values, dtype=np.uint16).byteswap()
+
+
+def pcapng_block(block_type: int, body: bytes) -> bytes:
+    block_len = itemsize__PcapngHeader + len(body) + 4
+    header = np.array([(block_type, block_len)], dtype=dtype__PcapngHeader)
+    return header.tobytes() + body + np.uint32(block_len).tobytes()
+
+
+def file_header() -> bytes:
+    section = np.array([(PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1)], dtype=dtype__PcapngSectionHeaderBlock)
+    interface = np.array([(LINKTYPE_ETHERNET, 0, 65535)], dtype=dtype__PcapngInterfaceDescriptionBlock)
+    # if_tsresol = 9, nanosecond timestamps like the IEX captures, then opt_endofopt.
+    options = np.array([9, 1], dtype="<u2").tobytes() + bytes([9, 0, 0, 0]) + bytes(4)
+    return pcapng_block(PCAPNG_SECTION_HEADER_BLOCK_TYPE, section.tobytes()) + pcapng_block(PCAPNG_INTERFACE_DESCRIPTION_BLOCK_TYPE, interface.tobytes() + options)
+
+
+def make_symbols(symbol_count: int) -> np.ndarray:
+    symbols = ["".join(chr(ord("A") + (s // 26**i) % 26) for i in range(4)) for s in range(symbol_count)]
+    return np.array([symbol.encode().ljust(8) for symbol in symbols], dtype="S8")
+
+
+def parse_mix(mix: typing.List[str]) -> typing.Tuple[np.ndarray, np.ndarray]:
+    message_indices = []
+    weights = []
+    for item in mix:
+        message_type, weight = item.split("=")
+        if len(message_type) != 1 or message_index__by_type[ord(message_type)] < 0:
+            raise ValueError(f"unknown message type {message_type}")
+        message_indices.append(message_index__by_type[ord(message_type)])
+        weights.append(float(weight))
+    weights = np.array(weights)
+    return np.array(message_indices, dtype=np.int64), weights / weights.sum()
+
+
+def fill_messages(rng: np.random.Generator, message_index: int, timestamps: np.ndarray, symbols: np.ndarray, base_prices: np.ndarray, sequence_numbers: np.ndarray) -> np.ndarray:
+    """
+    Fill the generated dtype of one message type field by field, from the field names the YAML structs declare.
+    """
+    name = message_names[message_index]
+    dtype = message_dtypes[message_index]
+    n = len(timestamps)
+    data = np.zeros(n, dtype=dtype)
+    prices = base_prices + rng.integers(-500, 501, n)
+    for column in dtype.names:
+        field = column[len(name) + 2 :]
+        if field == "message_type":
+            data[column] = MESSAGE_TYPE_BY_INDEX[message_index]
+        elif field == "timestamp":
+            data[column] = timestamps
+        elif field == "symbol":
+            data[column] = symbols.view(np.uint8).reshape(n, 8)
+        elif field == "ask_price":
+            data[column] = prices + rng.integers(100, 1000, n)
+        elif field.endswith("price") or field.endswith("collar"):
+            data[column] = prices
+        elif field.endswith("size") or field.endswith("shares"):
+            data[column] = rng.integers(1, 10, n) * 100
+        elif field == "trade_id":
+            data[column] = sequence_numbers
+    return data
+
+
+class PacketSynthesizer:
+    """
+    Produce batches of Enhanced Packet Blocks carrying IEX-TP TOPS segments.
+
+    All randomness comes from one generator seeded once, so the same seed and parameters give the same bytes.
+    """
+
+    def __init__(
+        self,
+        seed: int,
+        symbol_count: int,
+        mix: typing.List[str],
+        messages_per_packet: typing.Tuple[int, int],
+        start_time: int,
+    ):
+        self.rng = np.random.default_rng(seed)
+        self.symbols = make_symbols(symbol_count)
+        # a few symbols carry most of the volume, like SPY and QQQ do.
+        self.symbol_weights = 1.0 / np.arange(1, symbol_count + 1)
+        self.symbol_weights /= self.symbol_weights.sum()
+        self.base_prices = self.rng.integers(5, 500, symbol_count) * 10_000
+        self.message_indices, self.message_weights = parse_mix(mix)
+        self.messages_per_packet = messages_per_packet
+        self.send_time = start_time
+        self.sequence_number = 1
+        self.stream_offset = 0
+
+    def batch(self, packet_count: int) -> np.ndarray:
+        rng = self.rng
+        counts = rng.integers(self.messages_per_packet[0], self.messages_per_packet[1] + 1, packet_count)
+        message_count = int(counts.sum())
+        message_packets = np.repeat(np.arange(packet_count), counts)
+        message_types = self.message_indices[rng.choice(len(self.message_indices), message_count, p=self.message_weights)]
+        message_symbols = rng.choice(len(self.symbols), message_count, p=self.symbol_weights)
+
+        # message block = 2-byte length + message.
+        block_sizes = itemsize__MessageBlockHeader + message_itemsize__by_index[message_types]
+        block_starts = np.cumsum(block_sizes) - block_sizes
+        first_messages = np.cumsum(counts) - counts
+        payload_lengths = np.bincount(message_packets, weights=block_sizes, minlength=packet_count).astype(np.int64)
+
+        captured_lengths = FRAME_HEADER_SIZE + payload_lengths
+        block_lengths = itemsize__PcapngHeader + itemsize__PcapngEnhancedPacketBlock + ((captured_lengths + 3) & ~3) + 4
+        block_offsets = np.cumsum(block_lengths) - block_lengths
+        # where every packet of the batch ends, so a caller can cut it on a packet boundary.
+        self.block_ends = block_offsets + block_lengths
+        out = np.zeros(int(block_lengths.sum()), dtype=np.uint8)
+
+        send_times = self.send_time + np.cumsum(rng.integers(2_000, 200_000, packet_count))
+        self.send_time = int(send_times[-1])
+        message_timestamps = send_times[message_packets] - 1_000 + (np.arange(message_count) - first_messages[message_packets])
+        sequence_numbers = self.sequence_number + np.arange(message_count)
+        stream_offsets = self.stream_offset + np.cumsum(payload_lengths) - payload_lengths
+
+        pcapng_header = np.zeros(packet_count, dtype=dtype__PcapngHeader)
+        pcapng_header["PcapngHeader__block_type"] = PCAPNG_ENHANCED_PACKET_BLOCK_TYPE
+        pcapng_header["PcapngHeader__block_total_length"] = block_lengths
+
+        # captured a few microseconds after IEX sent it.
+        capture_times = (send_times + rng.integers(1_000, 5_000, packet_count)).astype(np.uint64)
+        epb = np.zeros(packet_count, dtype=dtype__PcapngEnhancedPacketBlock)
+        epb["PcapngEnhancedPacketBlock__timestamp_upper"] = capture_times >> np.uint64(32)
+        epb["PcapngEnhancedPacketBlock__timestamp_lower"] = capture_times & np.uint64(0xFFFFFFFF)
+        epb["PcapngEnhancedPacketBlock__captured_packet_length"] = captured_lengths
+        epb["PcapngEnhancedPacketBlock__original_packet_length"] = captured_lengths
+
+        ethernet = np.zeros(packet_count, dtype=dtype__EthernetIIHeader)
+        ethernet["EthernetIIHeader__destination_mac"] = (0x01, 0x00, 0x5E) + TOPS_MULTICAST_IP[1:]
+        ethernet["EthernetIIHeader__source_mac"] = (0x00, 0x1B, 0x21, 0x3A, 0x9C, 0x01)
+        ethernet["EthernetIIHeader__ethertype"] = network_order_u2(0x0800)
+
+        ipv4 = np.zeros(packet_count, dtype=dtype__Ipv4Header)
+        ipv4["Ipv4Header__version_ihl"] = 0x45
+        ipv4["Ipv4Header__total_length"] = network_order_u2(captured_lengths - itemsize__EthernetIIHeader)
+        ipv4["Ipv4Header__identification"] = network_order_u2(sequence_numbers[first_messages] & 0xFFFF)
+        ipv4["Ipv4Header__flags_fragment_offset"] = network_order_u2(0x4000)
+        ipv4["Ipv4Header__ttl"] = 64
+        ipv4["Ipv4Header__protocol"] = 17
+        ipv4["Ipv4Header__source_ip"] = TOPS_SOURCE_IP
+        ipv4["Ipv4Header__destination_ip"] = TOPS_MULTICAST_IP
+        checksum = ipv4.view(np.uint8).reshape(packet_count, itemsize__Ipv4Header).view(">u2").sum(axis=1, dtype=np.uint64)
+        checksum = (checksum & 0xFFFF) + (checksum >> np.uint64(16))
+        checksum = (checksum & 0xFFFF) + (checksum >> np.uint64(16))
+        ipv4["Ipv4Header__header_checksum"] = network_order_u2(~checksum.astype(np.uint16))
+
+        udp = np.zeros(packet_count, dtype=dtype__UdpHeader)
+        udp["UdpHeader__source_port"] = network_order_u2(TOPS_PORT)
+        udp["UdpHeader__destination_port"] = network_order_u2(TOPS_PORT)
+        udp["UdpHeader__length"] = network_order_u2(captured_lengths - itemsize__EthernetIIHeader - itemsize__Ipv4Header)
+
+        tp = np.zeros(packet_count, dtype=dtype__TransportProtocolHeader)
+        tp["TransportProtocolHeader__version"] = 1
+        tp["TransportProtocolHeader__message_protocol_id"] = TOPS_MESSAGE_PROTOCOL_ID
+        tp["TransportProtocolHeader__channel_id"] = TOPS_CHANNEL_ID
+        tp["TransportProtocolHeader__session_id"] = TOPS_SESSION_ID
+        tp["TransportProtocolHeader__payload_length"] = payload_lengths
+        tp["TransportProtocolHeader__message_count"] = counts
+        tp["TransportProtocolHeader__stream_offset"] = stream_offsets
+        tp["TransportProtocolHeader__first_message_sequence_number"] = sequence_numbers[first_messages]
+        tp["TransportProtocolHeader__send_time"] = send_times
+
+        headers = np.concatenate([header.view(np.uint8).reshape(packet_count, -1) for header in (pcapng_header, epb, ethernet, ipv4, udp, tp)], axis=1)
+        out[block_offsets[:, None] + np.arange(PACKET_HEADER_SIZE)] = headers
+        out[(block_offsets + block_lengths - 4)[:, None] + np.arange(4)] = block_lengths.astype("<u4").view(np.uint8).reshape(packet_count, 4)
+
+        message_offsets = block_offsets[message_packets] + PACKET_HEADER_SIZE + block_starts - block_starts[first_messages][message_packets]
+        for message_index in self.message_indices:
+            selected = np.flatnonzero(message_types == message_index)
+            if len(selected) == 0:
+                continue
+            itemsize = int(message_itemsize__by_index[message_index])
+            data = fill_messages(
+                rng,
+                message_index,
+                message_timestamps[selected],
+                self.symbols[message_symbols[selected]],
+                self.base_prices[message_symbols[selected]],
+                sequence_numbers[selected],
+            )
+            blocks = np.empty((len(selected), itemsize__MessageBlockHeader + itemsize), dtype=np.uint8)
+            blocks[:, :itemsize__MessageBlockHeader] = np.full(len(selected), itemsize, dtype="<u2").view(np.uint8).reshape(-1, itemsize__MessageBlockHeader)
+            blocks[:, itemsize__MessageBlockHeader:] = data.view(np.uint8).reshape(-1, itemsize)
+            out[message_offsets[selected][:, None] + np.arange(blocks.shape[1])] = blocks
+
+        self.sequence_number += message_count
+        self.stream_offset += int(payload_lengths.sum())
+        return out
+
+
+def open_pcap_sink(path: str) -> typing.BinaryIO:
+    if path.endswith(".gz"):
+        return gzip.open(path, "wb", compresslevel=1)
+    if path.endswith(".zst"):
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=3).stream_writer(open(path, "wb"), closefd=True)
+    return open(path, "wb")
+
+
+def synthesize_pcap(
+    output_path: str,
+    size_bytes: int,
+    seed: int = 0,
+    symbol_count: int = 500,
+    mix: typing.List[str] = DEFAULT_MIX,
+    messages_per_packet: typing.Tuple[int, int] = (1, 8),
+    date: str = "20240102",
+    packets_per_batch: int = PACKETS_PER_BATCH,
+) -> int:
+    """
+    Write a TOPS pcapng of whole packets, as many as fit in `size_bytes` uncompressed bytes, returns the number of
+    bytes written. The last batch is cut on the last packet boundary under the target.
+    """
+    # 09:30 New York time.
+    start = datetime.datetime.strptime(date, "%Y%m%d").replace(hour=14, minute=30, tzinfo=datetime.timezone.utc)
+    synthesizer = PacketSynthesizer(seed, symbol_count, mix, messages_per_packet, int(start.timestamp()) * 1_000_000_000)
+
+    with open_pcap_sink(output_path) as f:
+        header = file_header()
+        f.write(header)
+        written = len(header)
+        while True:
+            batch = synthesizer.batch(packets_per_batch)
+            packet_count = int(np.searchsorted(synthesizer.block_ends, size_bytes - written, side="right"))
+            if packet_count < packets_per_batch:
+                batch = batch[: synthesizer.block_ends[packet_count - 1]] if packet_count else batch[:0]
+            f.write(batch.tobytes())
+            written += len(batch)
+            logging.info(f"wrote {written} bytes")
+            if packet_count < packets_per_batch:
+                break
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", type=str, required=True, help="output path, .gz and .zst are compressed")
+    parser.add_argument("--size-mb", type=int, default=1024, help="uncompressed size not to exceed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--mix", type=str, nargs="+", default=DEFAULT_MIX, help="message type weights, e.g. Q=0.7 T=0.3")
+    parser.add_argument("--messages-per-packet", type=int, nargs=2, default=[1, 8], metavar=("MIN", "MAX"))
+    parser.add_argument("--date", type=str, default="20240102", help="trading day as YYYYMMDD")
+    args = parser.parse_args()
+
+    synthesize_pcap(
+        args.o,
+        args.size_mb * 1024 * 1024,
+        args.seed,
+        args.symbols,
+        args.mix,
+        tuple(args.messages_per_packet),
+        args.date,
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    main()
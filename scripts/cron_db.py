@@ -1,12 +1,43 @@
+import atexit
 import enum
 import logging
+import queue
+import random
 import sqlite3
 import threading
 import time
 import typing
-import uuid
 
-SQLITE_LOCK = threading.Lock()
+import zstandard
+
+# A write-behind writer commits at most WRITE_BATCH queued writes per transaction.
+WRITE_BATCH = 256
+
+# PRAGMA user_version of the schema init() creates or migrates to:
+#   1  uuid4 TEXT ids, no secondary indexes
+#   2  time ordered INTEGER ids, indexes on commands.group_id and logs.command_id
+#   3  command output in log_chunks, the stdout/stderr of logs are only kept for older rows
+SCHEMA_VERSION = 3
+
+# Command output is stored as independently compressed chunks of up to LOG_CHUNK_BYTES, so a byte range
+# only decompresses the chunks it overlaps.
+LOG_CHUNK_BYTES = 1024 * 1024
+LOG_ZSTD_LEVEL = 3
+LOG_STREAMS = ("stdout", "stderr")
+
+ID_LOCK = threading.Lock()
+LAST_ID = 0
+
+
+def new_id() -> int:
+    """
+    Time ordered 63-bit id: microseconds since the epoch in the high bits and a random low part, increasing
+    within the process. Ids are made here rather than by sqlite, so write-behind inserts can return them.
+    """
+    global LAST_ID
+    with ID_LOCK:
+        LAST_ID = max((time.time_ns() // 1000) << 10 | random.getrandbits(10), LAST_ID + 1)
+        return LAST_ID
 
 
 class CommandStatus(enum.Enum):
@@ -24,15 +55,15 @@ class GroupStatus(enum.Enum):
 class RowCommand:
     def __init__(
         self,
-        id_str: str,
+        id_int: int,
         created_at: str,
-        group_id: str,
+        group_id: int,
         command_order: int,
         command: str,
         command_status: CommandStatus,
         group_status: GroupStatus,
     ):
-        self.id_str = id_str
+        self.id = id_int
         self.created_at = created_at
         self.group_id = group_id
         self.command_order = command_order
@@ -44,15 +75,15 @@ class RowCommand:
 class RowLog:
     def __init__(
         self,
-        id_str: str,
-        command_id: str,
+        id_int: int,
+        command_id: int,
         created_at: str,
         command: str,
         return_code: int,
         stdout: str,
         stderr: str,
     ):
-        self.id_str = id_str
+        self.id = id_int
         self.command_id = command_id
         self.created_at = created_at
         self.command = command
@@ -64,28 +95,24 @@ class RowLog:
 class RowCommandGroup:
     def __init__(
         self,
-        id_str: str,
+        id_int: int,
         created_at: str,
         group_status: CommandStatus,
     ):
-        self.id_str = id_str
+        self.id = id_int
         self.created_at = created_at
         self.group_status = group_status
 
 
-class CronDb:
-    def __init__(self, database_path: str):
-        self.connection = sqlite3.Connection(database_path)
-        self.connection.set_trace_callback(logging.info)
-
-    def init(self):
-        cursor = self.connection.cursor()
-
-        cursor.execute("""
-CREATE TABLE IF NOT EXISTS "commands" (
-    "id" TEXT NOT NULL PRIMARY KEY,
+def create_schema(cursor: sqlite3.Cursor):
+    """
+    Schema version 2, later versions come from MIGRATIONS.
+    """
+    cursor.execute("""
+CREATE TABLE "commands" (
+    "id" INTEGER PRIMARY KEY,
     "created_at" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    "group_id" TEXT NOT NULL,
+    "group_id" INTEGER NOT NULL,
     "command_order" INTEGER NOT NULL,
     "command" TEXT NOT NULL,
     "command_status" TEXT NOT NULL,
@@ -93,10 +120,10 @@ CREATE TABLE IF NOT EXISTS "commands" (
 );
 """)
 
-        cursor.execute("""
-CREATE TABLE IF NOT EXISTS "logs" (
-    "id" TEXT NOT NULL PRIMARY KEY,
-    "command_id" TEXT NOT NULL,
+    cursor.execute("""
+CREATE TABLE "logs" (
+    "id" INTEGER PRIMARY KEY,
+    "command_id" INTEGER NOT NULL,
     "created_at" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     "command" TEXT NOT NULL,
     "return_code" INTEGER NOT NULL,
@@ -106,51 +133,272 @@ CREATE TABLE IF NOT EXISTS "logs" (
 );
 """)
 
-        self.connection.commit()
+    # update_command_failed marks a whole group, the server looks logs up by command.
+    cursor.execute("""
+CREATE INDEX "commands_by_group_id" ON "commands" ("group_id");
+""")
+    cursor.execute("""
+CREATE INDEX "logs_by_command_id" ON "logs" ("command_id");
+""")
 
-    def insert_commands(self, cmds: typing.List[str]):
-        time.sleep(0.1)
-        with SQLITE_LOCK:
-            group_id = "group-" + str(uuid.uuid4())
-            tuples = [
-                (
-                    "command-" + str(uuid.uuid4()),  #
-                    group_id,  #
-                    i,  #
-                    cmds[i],  #
-                    CommandStatus.Created.value,  #
-                    GroupStatus.Okay.value,  #
-                )
-                for i in range(len(cmds))
-            ]
+
+def migrate_1_to_2(cursor: sqlite3.Cursor):
+    """
+    uuid4 TEXT ids become INTEGER ids. The old rows keep their insertion order: a command takes its rowid, a
+    group the smallest rowid of its commands, and both stay below every id new_id() makes.
+    """
+    cursor.execute("""ALTER TABLE "commands" RENAME TO "commands_v1";""")
+    cursor.execute("""ALTER TABLE "logs" RENAME TO "logs_v1";""")
+    create_schema(cursor)
+    cursor.execute("""
+INSERT INTO
+"commands"
+("id", "created_at", "group_id", "command_order", "command", "command_status", "group_status")
+SELECT
+"commands_v1"."rowid", "commands_v1"."created_at", "groups"."group_rowid", "commands_v1"."command_order", "commands_v1"."command", "commands_v1"."command_status", "commands_v1"."group_status"
+FROM "commands_v1"
+JOIN (SELECT "group_id", MIN("rowid") AS "group_rowid" FROM "commands_v1" GROUP BY "group_id") AS "groups" ON "groups"."group_id" = "commands_v1"."group_id";
+""")
+    cursor.execute("""
+INSERT INTO
+"logs"
+("id", "command_id", "created_at", "command", "return_code", "stdout", "stderr")
+SELECT
+"logs_v1"."rowid", "commands_v1"."rowid", "logs_v1"."created_at", "logs_v1"."command", "logs_v1"."return_code", "logs_v1"."stdout", "logs_v1"."stderr"
+FROM "logs_v1"
+JOIN "commands_v1" ON "commands_v1"."id" = "logs_v1"."command_id";
+""")
+    cursor.execute("""DROP TABLE "logs_v1";""")
+    cursor.execute("""DROP TABLE "commands_v1";""")
+
+
+def migrate_2_to_3(cursor: sqlite3.Cursor):
+    # "offset" and "size" are of the uncompressed output.
+    cursor.execute("""
+CREATE TABLE "log_chunks" (
+    "id" INTEGER PRIMARY KEY,
+    "command_id" INTEGER NOT NULL,
+    "stream" TEXT NOT NULL,
+    "offset" INTEGER NOT NULL,
+    "size" INTEGER NOT NULL,
+    "data" BLOB NOT NULL,
+    FOREIGN KEY ("command_id") REFERENCES commands('id')
+);
+""")
+    cursor.execute("""
+CREATE UNIQUE INDEX "log_chunks_by_command_id" ON "log_chunks" ("command_id", "stream", "offset");
+""")
+
+
+# MIGRATIONS[v] migrates schema version v to v + 1.
+MIGRATIONS = {
+    1: migrate_1_to_2,
+    2: migrate_2_to_3,
+}
+
+
+class CronDb:
+    """
+    The commands and logs of GroundBlock.
+
+    The database is in WAL mode, so readers such as the server never block the writer. With `write_behind` the
+    inserts and updates are queued and a background thread commits them in order, many per transaction, and
+    the methods that write return right away. `flush` waits until everything queued so far is committed, the
+    selects flush first so they see their own writes, and `close` (also run at exit) flushes and stops the thread.
+    """
+
+    def __init__(self, database_path: str, write_behind: bool = False):
+        self.database_path = database_path
+        self.connection = self.connect()
+        self.lock = threading.Lock()
+        self.queue = None
+        self.writer = None
+        if write_behind:
+            self.queue = queue.Queue()
+            self.writer = threading.Thread(target=self.write_loop, name="cron-db-writer", daemon=True)
+            self.writer.start()
+            atexit.register(self.close)
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.Connection(self.database_path, timeout=60, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL;")
+        connection.set_trace_callback(logging.info)
+        return connection
+
+    def write(self, statements: typing.List[typing.Tuple[str, typing.Any, bool]]):
+        """
+        Run (sql, parameters, executemany) statements in one transaction, now or from the writer thread.
+        """
+        if self.queue is not None:
+            if self.writer.is_alive():
+                self.queue.put(statements)
+                return
+            logging.warning(f"the writer of {self.database_path} has stopped, writing synchronously")
+            # whatever the writer left queued goes first, to keep the order.
+            self.write_queued()
+        with self.lock:
+            self.execute(self.connection, statements)
+            self.connection.commit()
+
+    @staticmethod
+    def execute(connection: sqlite3.Connection, statements: typing.List[typing.Tuple[str, typing.Any, bool]]):
+        cursor = connection.cursor()
+        for sql, parameters, many in statements:
+            if many:
+                cursor.executemany(sql, parameters)
+            else:
+                cursor.execute(sql, parameters)
+
+    def commit_writes(self, connection: sqlite3.Connection, writes: typing.List[typing.List[typing.Tuple[str, typing.Any, bool]]]):
+        try:
+            for statements in writes:
+                self.execute(connection, statements)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            # retried one write at a time, in order, so only the bad one is lost.
+            for statements in writes:
+                try:
+                    self.execute(connection, statements)
+                    connection.commit()
+                except Exception:
+                    connection.rollback()
+                    logging.exception(f"dropped a write to {self.database_path}: {statements}")
+
+    def write_loop(self):
+        connection = self.connect()
+        try:
+            stop = False
+            while not stop:
+                items = [self.queue.get()]
+                while len(items) < WRITE_BATCH:
+                    try:
+                        items.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                # flush events and the stop marker are answered once the writes of the batch are committed.
+                events = [item for item in items if isinstance(item, threading.Event)]
+                stop = any(item is None for item in items)
+                try:
+                    self.commit_writes(connection, [item for item in items if isinstance(item, list)])
+                finally:
+                    for event in events:
+                        event.set()
+        finally:
+            connection.close()
+
+    def write_queued(self):
+        """
+        Write what is left in the queue from this thread, once the writer is gone.
+        """
+        with self.lock:
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    return
+                if isinstance(item, threading.Event):
+                    item.set()
+                elif item is not None:
+                    self.commit_writes(self.connection, [item])
+
+    def flush(self):
+        if self.queue is None:
+            return
+        event = threading.Event()
+        if self.writer.is_alive():
+            self.queue.put(event)
+            # the writer always answers, unless it died, then what it left is written from here.
+            while not event.wait(timeout=1):
+                if not self.writer.is_alive():
+                    break
+        if not self.writer.is_alive():
+            self.write_queued()
+
+    def close(self):
+        if self.writer is not None:
+            if self.writer.is_alive():
+                self.queue.put(None)
+                self.writer.join()
+            self.write_queued()
+        with self.lock:
+            self.connection.close()
+
+    def init(self):
+        """
+        Create the schema, or migrate it in place to SCHEMA_VERSION.
+        """
+        with self.lock:
             cursor = self.connection.cursor()
-            cursor.executemany(
-                """
+            # taken before reading the version, so two processes cannot both migrate.
+            cursor.execute("BEGIN IMMEDIATE;")
+            try:
+                version = cursor.execute("PRAGMA user_version;").fetchone()[0]
+                if version == 0 and cursor.execute("""SELECT 1 FROM "sqlite_master" WHERE "type" = 'table' AND "name" = 'commands';""").fetchone():
+                    # databases from before the version was recorded.
+                    version = 1
+                if version > SCHEMA_VERSION:
+                    raise RuntimeError(f"{self.database_path} has schema version {version}, newer than {SCHEMA_VERSION}")
+
+                if version == 0:
+                    create_schema(cursor)
+                    version = 2
+                for v in range(version, SCHEMA_VERSION):
+                    logging.info(f"migrating {self.database_path} from schema version {v} to {v + 1}")
+                    MIGRATIONS[v](cursor)
+                cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION};")
+                self.connection.commit()
+            except BaseException:
+                self.connection.rollback()
+                raise
+
+    def insert_commands(self, cmds: typing.List[str]) -> typing.Tuple[typing.List[typing.Tuple[int, str]], int]:
+        group_id = new_id()
+        tuples = [
+            (
+                new_id(),  #
+                group_id,  #
+                i,  #
+                cmds[i],  #
+                CommandStatus.Created.value,  #
+                GroupStatus.Okay.value,  #
+            )
+            for i in range(len(cmds))
+        ]
+        self.write(
+            [
+                (
+                    """
 INSERT INTO 
 "commands" 
 ("id", "group_id", "command_order", "command", "command_status", "group_status") 
 VALUES 
 (?, ?, ?, ?, ?, ?);
 """,
-                tuples,
-            )
-            self.connection.commit()
-            return [(t[0], t[3]) for t in tuples], group_id
+                    tuples,
+                    True,
+                )
+            ]
+        )
+        return [(t[0], t[3]) for t in tuples], group_id
 
     def select_commands(self) -> typing.List[RowCommand]:
-        time.sleep(0.1)
-        with SQLITE_LOCK:
+        self.flush()
+        with self.lock:
             cursor = self.connection.cursor()
             cursor.execute("""
 SELECT 
 "id", "created_at", "group_id", "command_order", "command", "command_status", "group_status"
 FROM 
-"commands";
+"commands"
+ORDER BY
+"id";
     """)
             res = cursor.fetchall()
-            # "id" INTEGER PRIMARY KEY AUTOINCREMENT,
+            # "id" INTEGER PRIMARY KEY,
             # "created_at" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            # "group_id" TEXT NOT NULL,
+            # "group_id" INTEGER NOT NULL,
             # "command_order" INTEGER NOT NULL,
             # "command" TEXT NOT NULL,
             # "command_status" TEXT NOT NULL,
@@ -169,12 +417,11 @@ FROM
                 for t in res
             ]
 
-    def update_command_completed(self, command_id: str):
-        time.sleep(0.1)
-        with SQLITE_LOCK:
-            cursor = self.connection.cursor()
-            cursor.execute(
-                """
+    def update_command_completed(self, command_id: int):
+        self.write(
+            [
+                (
+                    """
 UPDATE 
 "commands" 
 SET 
@@ -182,16 +429,17 @@ SET
 WHERE 
 "id" = ?;
 """,
-                (CommandStatus.Completed.value, command_id),
-            )
-            self.connection.commit()
+                    (CommandStatus.Completed.value, command_id),
+                    False,
+                )
+            ]
+        )
 
-    def update_command_failed(self, group_id: str, command_id: str):
-        time.sleep(0.1)
-        with SQLITE_LOCK:
-            cursor = self.connection.cursor()
-            cursor.execute(
-                """
+    def update_command_failed(self, group_id: int, command_id: int):
+        self.write(
+            [
+                (
+                    """
 UPDATE 
 "commands" 
 SET 
@@ -199,10 +447,11 @@ SET
 WHERE 
 "id" = ? AND "group_id" = ?;
 """,
-                (CommandStatus.Failed.value, command_id, group_id),
-            )
-            cursor.execute(
-                """
+                    (CommandStatus.Failed.value, command_id, group_id),
+                    False,
+                ),
+                (
+                    """
 UPDATE 
 "commands" 
 SET 
@@ -210,30 +459,33 @@ SET
 WHERE 
 "group_id" = ?;
 """,
-                (GroupStatus.Failed.value, group_id),
-            )
-            self.connection.commit()
+                    (GroupStatus.Failed.value, group_id),
+                    False,
+                ),
+            ]
+        )
 
-    def insert_log(self, command_id: str, command: str, return_code: int, stdout: str, stderr: str):
-        time.sleep(0.1)
-        with SQLITE_LOCK:
-            log_id = "log-" + str(uuid.uuid4())
-            cursor = self.connection.cursor()
-            cursor.execute(
-                """
+    def insert_log(self, command_id: int, command: str, return_code: int, stdout: str, stderr: str):
+        log_id = new_id()
+        self.write(
+            [
+                (
+                    """
 INSERT INTO 
 "logs" 
 ("id", "command_id", "command", "return_code", "stdout", "stderr") 
 VALUES 
 (?, ?, ?, ?, ?, ?);
 """,
-                (log_id, command_id, command, return_code, stdout, stderr),
-            )
-            self.connection.commit()
+                    (log_id, command_id, command, return_code, stdout, stderr),
+                    False,
+                )
+            ]
+        )
 
-    def select_log(self, command_id: str) -> typing.Optional[RowLog]:
-        time.sleep(0.1)
-        with SQLITE_LOCK:
+    def select_log(self, command_id: int) -> typing.Optional[RowLog]:
+        self.flush()
+        with self.lock:
             cursor = self.connection.cursor()
             cursor.execute(
                 """
@@ -252,3 +504,90 @@ WHERE
                 return res
 
             return RowLog(res[0], res[1], res[2], res[3], res[4], res[5], res[6])
+
+    def insert_log_chunk(self, command_id: int, stream: str, offset: int, data: bytes):
+        """
+        Store bytes `offset..offset + len(data)` of a command's `stream`.
+        """
+        compressed = zstandard.ZstdCompressor(level=LOG_ZSTD_LEVEL).compress(data)
+        self.write(
+            [
+                (
+                    """
+INSERT INTO 
+"log_chunks" 
+("id", "command_id", "stream", "offset", "size", "data") 
+VALUES 
+(?, ?, ?, ?, ?, ?);
+""",
+                    (new_id(), command_id, stream, offset, len(data), compressed),
+                    False,
+                )
+            ]
+        )
+
+    def select_log_text(self, command_id: int, stream: str) -> bytes:
+        # output of the logs from before log_chunks.
+        if stream not in LOG_STREAMS:
+            raise ValueError(f"unknown stream {stream}")
+        cursor = self.connection.cursor()
+        cursor.execute(f"""SELECT "{stream}" FROM "logs" WHERE "command_id" = ?;""", (command_id,))
+        res = cursor.fetchone()
+        return b"" if res is None else res[0].encode()
+
+    def select_log_size(self, command_id: int, stream: str) -> int:
+        self.flush()
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute(
+                """
+SELECT 
+"offset" + "size"
+FROM 
+"log_chunks"
+WHERE
+"command_id" = ? AND "stream" = ?
+ORDER BY
+"offset" DESC
+LIMIT 1;
+""",
+                (command_id, stream),
+            )
+            res = cursor.fetchone()
+            if res is None:
+                return len(self.select_log_text(command_id, stream))
+            return res[0]
+
+    def select_log_range(self, command_id: int, stream: str, start: int, stop: int) -> bytes:
+        """
+        Bytes `start..stop` of a command's `stream`, decompressing only the chunks they fall in.
+        """
+        self.flush()
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute(
+                """
+SELECT 
+"offset", "data"
+FROM 
+"log_chunks"
+WHERE
+"command_id" = ? AND "stream" = ? AND "offset" < ?
+AND "offset" >= COALESCE((SELECT MAX("offset") FROM "log_chunks" WHERE "command_id" = ? AND "stream" = ? AND "offset" <= ?), 0)
+ORDER BY
+"offset";
+""",
+                (command_id, stream, stop, command_id, stream, start),
+            )
+            res = cursor.fetchall()
+            if not res:
+                return self.select_log_text(command_id, stream)[start:stop]
+
+            decompressor = zstandard.ZstdDecompressor()
+            data = b"".join(decompressor.decompress(t[1]) for t in res)
+            first_offset = res[0][0]
+            return data[max(start - first_offset, 0) : stop - first_offset]
+
+    def select_log_tail(self, command_id: int, stream: str, size: int) -> bytes:
+        stop = self.select_log_size(command_id, stream)
+        return self.select_log_range(command_id, stream, max(stop - size, 0), stop)
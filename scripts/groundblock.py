@@ -1,6 +1,8 @@
+import concurrent.futures
 import heapq
 import logging
-import multiprocessing
+import os
+import selectors
 import subprocess
 import threading
 import time
@@ -8,87 +10,220 @@ import typing
 from datetime import datetime as dt
 from cron_converter import Cron
 
-from cron_db import CronDb, RowCommand
+from cron_db import LOG_CHUNK_BYTES, CronDb, RowCommand
+
+# A chunk of output is stored once it reaches LOG_CHUNK_BYTES, or after LOG_FLUSH_SECONDS, so slow commands
+# can be followed while they run.
+LOG_FLUSH_SECONDS = 5
+
+
+def capture_output(cron_db: CronDb, command_id: int, stream: str, pipe: typing.BinaryIO) -> int:
+    """
+    Copy a pipe into the log chunks of a command until it closes, holding at most about one chunk in memory.
+    """
+    offset = 0
+    buffer = bytearray()
+    buffered_at = None
+    fd = pipe.fileno()
+    with selectors.DefaultSelector() as selector:
+        selector.register(fd, selectors.EVENT_READ)
+        while True:
+            # a silent command still gets what it printed stored once LOG_FLUSH_SECONDS have passed.
+            timeout = None if buffered_at is None else max(LOG_FLUSH_SECONDS - (time.monotonic() - buffered_at), 0)
+            data = os.read(fd, LOG_CHUNK_BYTES) if selector.select(timeout) else None
+            closed = data == b""
+            if data:
+                buffer += data
+                if buffered_at is None:
+                    buffered_at = time.monotonic()
+            if buffer and (closed or len(buffer) >= LOG_CHUNK_BYTES or time.monotonic() - buffered_at >= LOG_FLUSH_SECONDS):
+                cron_db.insert_log_chunk(command_id, stream, offset, bytes(buffer))
+                offset += len(buffer)
+                buffer.clear()
+                buffered_at = None
+            if closed:
+                return offset
+
+
+def run_command(cron_db: CronDb, command_id: int, cmd: str) -> int:
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+    stderr_thread = threading.Thread(target=capture_output, args=(cron_db, command_id, "stderr", process.stderr))
+    stderr_thread.start()
+    capture_output(cron_db, command_id, "stdout", process.stdout)
+    stderr_thread.join()
+    return process.wait()
 
 
 class CronJob:
-    def __init__(self, name: str, cron: str, commands: typing.List[typing.Callable[[dt], str]], db_path: str, dry_run: bool):
+    """
+    A group of commands fired on a cron schedule.
+
+    `dependencies` maps a command to the commands that must complete before it starts, commands that do not
+    depend on each other run concurrently on up to `workers` threads. Without it every command depends on the
+    previous one. A failed command marks the group as failed and nothing that depends on it is started.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        cron: str,
+        commands: typing.List[typing.Callable[[dt], str]],
+        db_path: str,
+        dry_run: bool,
+        dependencies: typing.Optional[typing.Dict[typing.Callable[[dt], str], typing.List[typing.Callable[[dt], str]]]] = None,
+        workers: int = 4,
+    ):
         self.name = name
         self.cron = cron
         self.commands = commands
         self.db_path = db_path
         self.schedule = Cron(cron).schedule(start_date=dt.now())
         self.dry_run = dry_run
-
-    def _run(self):
-        cron_db = CronDb(self.db_path)
-        while True:
-            dt_next = self.schedule.next()
-
-            if not self.dry_run:
-                dt_now = dt.now()
-                if dt_next > dt_now:
-                    time_to_sleep = (dt_next - dt_now).total_seconds() / 1_000_000_000
-
-                    if time_to_sleep > 0:
-                        logging.info(f"{self.name} sleeping for {time_to_sleep} seconds from {dt_now} to {dt_next}")
-                        time.sleep(time_to_sleep)
-
-            cmds, group_id = cron_db.insert_commands([c(dt_next) for c in self.commands])
-
-            for t in cmds:
-                cmd_id, cmd = t
+        self.workers = workers
+
+        if dependencies is None:
+            dependencies = {commands[i]: [commands[i - 1]] for i in range(1, len(commands))}
+        for command, requires in dependencies.items():
+            for c in [command] + list(requires):
+                if c not in commands:
+                    raise ValueError(f"{name}: {c.__name__} is not one of the commands")
+        self.dependencies = [{commands.index(c) for c in dependencies.get(command, [])} for command in commands]
+        self.check_acyclic()
+
+    def check_acyclic(self):
+        remaining = {i: set(requires) for i, requires in enumerate(self.dependencies)}
+        while remaining:
+            ready = [i for i, requires in remaining.items() if not requires]
+            if not ready:
+                raise ValueError(f"{self.name}: the command dependencies have a cycle")
+            for i in ready:
+                del remaining[i]
+            for requires in remaining.values():
+                requires.difference_update(ready)
+
+    def _run(self, cron_db: CronDb, dt_next: dt):
+        cmds, group_id = cron_db.insert_commands([c(dt_next) for c in self.commands])
+
+        if self.dry_run:
+            for cmd_id, cmd in cmds:
                 logging.info(f"running cmd_id:{cmd_id} => '{cmd}'")
-                if not self.dry_run:
-                    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, shell=True)
-
-                    # Output of the command
-                    stdout_output = result.stdout
-                    stderr_output = result.stderr
-
-                    cron_db.insert_log(cmd_id, cmd, result.returncode, stdout_output, stderr_output)
-                    if result.returncode == 0:
-                        cron_db.update_command_completed(cmd)
+            return
+
+        remaining = {i: set(requires) for i, requires in enumerate(self.dependencies)}
+        running = {}
+        # the commands run on the pool, which also stores their output as it comes.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while remaining or running:
+                for i in [i for i, requires in remaining.items() if not requires]:
+                    del remaining[i]
+                    cmd_id, cmd = cmds[i]
+                    logging.info(f"running cmd_id:{cmd_id} => '{cmd}'")
+                    running[pool.submit(run_command, cron_db, cmd_id, cmd)] = i
+
+                if not running:
+                    # whatever is left depends on a failed command.
+                    break
+
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    i = running.pop(future)
+                    cmd_id, cmd = cmds[i]
+                    return_code = future.result()
+
+                    # the output is in the log chunks already.
+                    cron_db.insert_log(cmd_id, cmd, return_code, "", "")
+                    if return_code == 0:
+                        cron_db.update_command_completed(cmd_id)
+                        for requires in remaining.values():
+                            requires.discard(i)
                     else:
-                        cron_db.update_command_failed(group_id, cmd)
-                        break
-            # print("ended")
+                        cron_db.update_command_failed(group_id, cmd_id)
+                        self.drop_dependents(remaining, i)
 
-    def run(self):
+    def drop_dependents(self, remaining: typing.Dict[int, typing.Set[int]], failed: int):
+        failed = {failed}
+        while True:
+            dependents = [i for i, requires in remaining.items() if requires & failed]
+            if not dependents:
+                return
+            for i in dependents:
+                logging.info(f"skipping cmd '{self.commands[i].__name__}', a command it depends on failed")
+                del remaining[i]
+                failed.add(i)
+
+    def run(self, cron_db: CronDb, dt_next: dt):
         try:
-            self._run()
-        except BaseException as e:
-            print(e)
+            self._run(cron_db, dt_next)
+        except BaseException:
+            logging.exception(f"{self.name} failed at {dt_next}")
 
 
-def run_cron(cron_job: CronJob):
-    cron_job.run()
+class GroundBlock:
+    """
+    Runs every cron job from one scheduler loop.
 
+    The loop keeps a heap of (next fire time, job) and sleeps until the earliest one. Due jobs run on a pool of
+    `workers` threads, and a job is only put back in the heap once its run is over, so a job never overlaps itself.
+    """
 
-class GroundBlock:
-    def __init__(self, db_path: str, dry_run: bool = False):
+    def __init__(self, db_path: str, dry_run: bool = False, workers: int = 4):
         self.db_path = db_path
         self.cron_jobs: typing.List[CronJob] = []
         self.dry_run = dry_run
+        self.workers = workers
 
-        cron_db = CronDb(db_path)
-        cron_db.init()
-
-    def add(self, name: str, cron_str: str, commands: typing.List[typing.Callable[[dt], str]]):
-        self.cron_jobs.append(CronJob(name, cron_str, commands, self.db_path, self.dry_run))
+        # one connection for every worker, its writes are batched by a background thread.
+        self.cron_db = CronDb(db_path, write_behind=True)
+        self.cron_db.init()
 
-    def run(self):
-        threads = []
-
-        for cron_job in self.cron_jobs:
-            thread = multiprocessing.Process(target=run_cron, args=(cron_job,))
-            threads.append(thread)
+    def add(
+        self,
+        name: str,
+        cron_str: str,
+        commands: typing.List[typing.Callable[[dt], str]],
+        dependencies: typing.Optional[typing.Dict[typing.Callable[[dt], str], typing.List[typing.Callable[[dt], str]]]] = None,
+    ):
+        self.cron_jobs.append(CronJob(name, cron_str, commands, self.db_path, self.dry_run, dependencies))
 
-        for t in threads:
-            t.start()
+    def run_job(self, cron_job: CronJob, dt_next: dt):
+        cron_job.run(self.cron_db, dt_next)
 
-        for t in threads:
-            t.join()
+    def run(self):
+        try:
+            self.schedule()
+        finally:
+            self.cron_db.close()
+
+    def schedule(self):
+        condition = threading.Condition()
+        heap = [(cron_job.schedule.next(), i) for i, cron_job in enumerate(self.cron_jobs)]
+        heapq.heapify(heap)
+
+        def reschedule(i: int):
+            with condition:
+                heapq.heappush(heap, (self.cron_jobs[i].schedule.next(), i))
+                condition.notify()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool, condition:
+            while True:
+                if not heap:
+                    condition.wait()
+                    continue
+
+                dt_next, i = heap[0]
+                cron_job = self.cron_jobs[i]
+                if not self.dry_run:
+                    dt_now = dt.now()
+                    time_to_sleep = (dt_next - dt_now).total_seconds()
+                    if time_to_sleep > 0:
+                        logging.info(f"{cron_job.name} is next, sleeping for {time_to_sleep} seconds from {dt_now} to {dt_next}")
+                        # a job finishing wakes the loop up, its next fire time may come first.
+                        condition.wait(timeout=time_to_sleep)
+                        continue
+
+                heapq.heappop(heap)
+                future = pool.submit(self.run_job, cron_job, dt_next)
+                future.add_done_callback(lambda _, i=i: reschedule(i))
 
 
 def main():
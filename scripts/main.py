@@ -51,28 +51,26 @@ def rclone_commit(dt_current: dt) -> str:
 
 
 def run(db_path: str, dry_run: bool):
+    rclone_copies = [
+        rclone_google_drive_hanif,  #
+        rclone_google_drive_asadun,  #
+        rclone_google_photos_hanif,  #
+        rclone_google_photos_asadun,  #
+    ]
+
     ground_block = GroundBlock(db_path, dry_run)
     ground_block.add(
         "Cloud Storage Rclone",
         "0 0 * * *",
-        [
-            rclone_google_drive_hanif,  #
-            rclone_google_drive_asadun,  #
-            rclone_google_photos_hanif,  #
-            rclone_google_photos_asadun,  #
-            rclone_commit,  #
-        ],
+        rclone_copies + [rclone_commit],
+        # the copies are independent and run together, the commit waits for all of them.
+        {rclone_commit: rclone_copies},
     )
     ground_block.add(
         "Process Pcap Data",
         "0 0 * * *",
-        [
-            rclone_google_drive_hanif,  #
-            rclone_google_drive_asadun,  #
-            rclone_google_photos_hanif,  #
-            rclone_google_photos_asadun,  #
-            rclone_commit,  #
-        ],
+        rclone_copies + [rclone_commit],
+        {rclone_commit: rclone_copies},
     )
     ground_block.run()
 
@@ -0,0 +1,191 @@
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import typing
+
+import numpy as np
+import tables
+
+import day_format
+
+# bump when the bar layout or the way bars are cut changes, so old cache entries are not reused.
+BARS_VERSION = 1
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "iex-tools", "bars")
+
+TIME_UNITS = {
+    "ns": 1,
+    "us": 1_000,
+    "ms": 1_000_000,
+    "s": 1_000_000_000,
+    "m": 60_000_000_000,
+    "h": 3_600_000_000_000,
+}
+
+# prices are fixed point with 4 decimals, like in the messages.
+bar_dtype = np.dtype(
+    [
+        ("symbol", "S8"),
+        ("start", "<u8"),
+        ("end", "<u8"),
+        ("open", "<u8"),
+        ("high", "<u8"),
+        ("low", "<u8"),
+        ("close", "<u8"),
+        ("volume", "<u8"),
+        ("dollar_volume", "<f8"),
+        ("vwap", "<f8"),
+        ("trade_count", "<u4"),
+    ]
+)
+
+
+def parse_bar_spec(spec: str) -> typing.Tuple[str, float]:
+    """
+    `1s`, `1m`, `5m`... for time bars, `volume:<shares>` and `dollar:<dollars>` for activity bars.
+    """
+    if ":" in spec:
+        kind, size = spec.split(":")
+        if kind not in ("volume", "dollar"):
+            raise ValueError(f"unknown bar kind {kind}")
+        return kind, float(size)
+    for unit in sorted(TIME_UNITS, key=len, reverse=True):
+        if spec.endswith(unit) and spec[: -len(unit)].isdigit():
+            return "time", int(spec[: -len(unit)]) * TIME_UNITS[unit]
+    raise ValueError(f"unknown bar spec {spec}")
+
+
+def make_bars(trades: np.ndarray, kind: str, size: float) -> np.ndarray:
+    """
+    Cut the trades of one symbol, sorted by timestamp, into bars with segment reductions.
+    """
+    if len(trades) == 0:
+        return np.empty(0, dtype=bar_dtype)
+
+    timestamps = trades["timestamp"]
+    prices = trades["price"]
+    sizes = trades["size"].astype(np.uint64)
+    dollars = prices * sizes / 10_000
+
+    # a trade belongs to the bar its first share (or dollar) falls in.
+    if kind == "time":
+        ids = timestamps // np.uint64(size)
+    elif kind == "volume":
+        ids = (np.cumsum(sizes) - sizes) // np.uint64(size)
+    else:
+        ids = ((np.cumsum(dollars) - dollars) // size).astype(np.uint64)
+
+    starts = np.flatnonzero(np.diff(ids, prepend=ids[0] + np.uint64(1)))
+    stops = np.append(starts[1:], len(trades))
+
+    bars = np.empty(len(starts), dtype=bar_dtype)
+    bars["symbol"] = trades["symbol"][0]
+    bars["start"] = ids[starts] * np.uint64(size) if kind == "time" else timestamps[starts]
+    bars["end"] = timestamps[stops - 1]
+    bars["open"] = prices[starts]
+    bars["high"] = np.maximum.reduceat(prices, starts)
+    bars["low"] = np.minimum.reduceat(prices, starts)
+    bars["close"] = prices[stops - 1]
+    bars["volume"] = np.add.reduceat(sizes, starts)
+    bars["dollar_volume"] = np.add.reduceat(dollars, starts)
+    bars["vwap"] = bars["dollar_volume"] * 10_000 / bars["volume"]
+    bars["trade_count"] = stops - starts
+    return bars
+
+
+def symbol_bars(task) -> np.ndarray:
+    h5_path, symbols, kind, size = task
+    with tables.open_file(h5_path, "r") as h5_file:
+        symbol_index = day_format.read_symbol_index(h5_file, "trade_report_message")
+        bars = [make_bars(day_format.read_symbol(h5_file, "trade_report_message", symbol, symbol_index), kind, size) for symbol in symbols]
+    return np.concatenate(bars) if bars else np.empty(0, dtype=bar_dtype)
+
+
+def cache_path(cache_dir: str, h5_path: str, spec: str, symbols: typing.Optional[typing.List[str]]) -> str:
+    stat = os.stat(h5_path)
+    key = {
+        "version": BARS_VERSION,
+        "path": os.path.abspath(h5_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "spec": spec,
+        "symbols": None if symbols is None else sorted(symbols),
+    }
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    return os.path.join(cache_dir, f"{os.path.splitext(os.path.basename(h5_path))[0]}-{digest}.npy")
+
+
+def build_bars(
+    h5_path: str,
+    spec: str,
+    symbols: typing.Optional[typing.List[str]] = None,
+    workers: int = 1,
+    cache_dir: typing.Optional[str] = CACHE_PATH,
+    symbols_per_task: int = 64,
+) -> np.ndarray:
+    """
+    Bars of every symbol (or of `symbols`) of a day file, sorted by symbol and time.
+
+    Results are cached under `cache_dir` keyed by the file's path, size and mtime and the parameters,
+    pass `cache_dir=None` to always rebuild.
+    """
+    kind, size = parse_bar_spec(spec)
+    path = None
+    if cache_dir is not None:
+        path = cache_path(cache_dir, h5_path, spec, symbols)
+        if os.path.exists(path):
+            return np.load(path)
+
+    if symbols is None:
+        with tables.open_file(h5_path, "r") as h5_file:
+            symbols = day_format.list_symbols(h5_file, "trade_report_message")
+    symbols = sorted(symbols, key=day_format.pad_symbol)
+    tasks = [(h5_path, symbols[i : i + symbols_per_task], kind, size) for i in range(0, len(symbols), symbols_per_task)]
+
+    if workers > 1:
+        with multiprocessing.Pool(processes=workers) as pool:
+            parts = pool.map(symbol_bars, tasks)
+    else:
+        parts = [symbol_bars(task) for task in tasks]
+    bars = np.concatenate(parts) if parts else np.empty(0, dtype=bar_dtype)
+
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # written aside and renamed, so a concurrent reader never loads a partial file.
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, bars)
+        os.replace(tmp_path, path)
+    return bars
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", type=str, required=True, help="day file")
+    parser.add_argument("-o", type=str, default=None, help="write the bars to this .npy or .csv")
+    parser.add_argument("--bar", type=str, default="1m", help="1s, 1m, 5m..., volume:<shares> or dollar:<dollars>")
+    parser.add_argument("--symbols", type=str, nargs="+", default=None)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--cache-dir", type=str, default=CACHE_PATH)
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args()
+
+    bars = build_bars(args.i, args.bar, args.symbols, args.workers, None if args.no_cache else args.cache_dir)
+    logging.info(f"{len(bars)} bars")
+    if args.o is None:
+        print(bars)
+    elif args.o.endswith(".csv"):
+        with open(args.o, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(bar_dtype.names)
+            writer.writerows((row[0].decode().rstrip(), *row[1:]) for row in bars.tolist())
+    else:
+        np.save(args.o, bars)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    main()
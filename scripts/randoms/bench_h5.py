@@ -0,0 +1,159 @@
+import argparse
+import csv
+import itertools
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import typing
+
+import numpy as np
+import tables
+
+import day_format
+import gen_h5
+
+
+def generate_raw_dataset(output_path: str, symbol_count: int, rows_per_symbol: int, seed: int):
+    """
+    Write a per-symbol raw tree in the layout convert-pcap produces, with random-walk prices and sorted timestamps.
+    """
+    rng = np.random.default_rng(seed)
+    start_ts = 1_700_000_000_000_000_000
+    for s in range(symbol_count):
+        symbol = "".join(chr(ord("A") + (s // 26**i) % 26) for i in range(4))
+        os.makedirs(os.path.join(output_path, symbol), exist_ok=True)
+        # a few symbols carry most of the volume, like SPY and QQQ do.
+        rows = int(np.clip(rows_per_symbol * rng.pareto(1.5), 1, 50 * rows_per_symbol))
+
+        for table_name, file_dtype in day_format.TABLES.items():
+            data = np.zeros(rows, dtype=file_dtype)
+            data["timestamp"] = start_ts + np.cumsum(rng.integers(1, 1_000_000, rows))
+            data["symbol"] = day_format.pad_symbol(symbol)
+            price = 1_000_000 + np.cumsum(rng.integers(-100, 101, rows))
+            if table_name == "trade_report_message":
+                data["message_type"] = ord("T")
+                data["size"] = rng.integers(1, 1000, rows)
+                data["price"] = price
+                data["trade_id"] = np.arange(rows)
+            else:
+                data["message_type"] = ord("Q")
+                data["bid_size"] = rng.integers(1, 1000, rows)
+                data["bid_price"] = price
+                data["ask_price"] = price + rng.integers(1, 100, rows)
+                data["ask_size"] = rng.integers(1, 1000, rows)
+            data.tofile(os.path.join(output_path, symbol, f"{table_name}.bin"))
+
+
+def raw_dataset_bytes(input_path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, filename)) for root, _, filenames in os.walk(input_path) for filename in filenames)
+
+
+def bench(
+    input_path: str,
+    output_path: str,
+    compression_library: str,
+    compression_level: int,
+    shuffle: str,
+    chunk_kb: typing.Optional[int],
+    symbol_samples: int,
+) -> typing.Dict[str, typing.Any]:
+    raw_bytes = raw_dataset_bytes(input_path)
+
+    write_start = time.perf_counter()
+    gen_h5.run(
+        input_path,
+        output_path,
+        compression_level,
+        compression_library,
+        chunk_bytes=None if chunk_kb is None else chunk_kb * 1024,
+        shuffle=shuffle,
+    )
+    write_seconds = time.perf_counter() - write_start
+
+    read_start = time.perf_counter()
+    read_bytes = 0
+    with tables.open_file(output_path, "r") as h5_file:
+        for table_name in day_format.TABLES:
+            read_bytes += h5_file.get_node(f"/{table_name}").read().nbytes
+    read_seconds = time.perf_counter() - read_start
+
+    with tables.open_file(output_path, "r") as h5_file:
+        symbols = day_format.list_symbols(h5_file, "quote_update_message")
+    symbols = symbols[:: max(len(symbols) // symbol_samples, 1)][:symbol_samples]
+    latencies = []
+    for symbol in symbols:
+        symbol_start = time.perf_counter()
+        with tables.open_file(output_path, "r") as h5_file:
+            day_format.read_symbol(h5_file, "quote_update_message", symbol)
+        latencies.append(time.perf_counter() - symbol_start)
+
+    file_bytes = os.path.getsize(output_path)
+    return {
+        "complib": compression_library,
+        "complevel": compression_level,
+        "shuffle": shuffle,
+        "chunk_kb": chunk_kb,
+        "raw_bytes": raw_bytes,
+        "file_bytes": file_bytes,
+        "compression_ratio": raw_bytes / file_bytes,
+        "write_mb_s": raw_bytes / write_seconds / 1e6,
+        "read_mb_s": read_bytes / read_seconds / 1e6,
+        "symbol_read_ms_p50": float(np.median(latencies)) * 1e3 if latencies else None,
+        "symbol_read_ms_max": max(latencies) * 1e3 if latencies else None,
+    }
+
+
+def write_report(report_path: str, results: typing.List[typing.Dict[str, typing.Any]]):
+    if report_path.endswith(".csv"):
+        with open(report_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+            writer.writeheader()
+            writer.writerows(results)
+    else:
+        with open(report_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", type=str, default=None, help="raw per-symbol tree, a synthetic one is generated when omitted")
+    parser.add_argument("-o", type=str, required=True, help="report path, .csv or .json")
+    parser.add_argument("--complibs", type=str, nargs="+", default=["blosc:lz4", "blosc:zstd", "blosc2:zstd", "zlib"])
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 5, 9])
+    parser.add_argument("--shuffles", type=str, nargs="+", default=gen_h5.SHUFFLES, choices=gen_h5.SHUFFLES)
+    parser.add_argument("--chunk-kb", type=int, nargs="+", default=[0], help="0 lets PyTables pick the chunk shape")
+    parser.add_argument("--symbol-samples", type=int, default=50)
+    parser.add_argument("--synthetic-symbols", type=int, default=200)
+    parser.add_argument("--synthetic-rows", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    work_path = tempfile.mkdtemp(prefix="bench_h5_")
+    try:
+        input_path = args.i
+        if input_path is None:
+            input_path = os.path.join(work_path, "raw")
+            generate_raw_dataset(input_path, args.synthetic_symbols, args.synthetic_rows, args.seed)
+
+        results = []
+        for compression_library, compression_level, shuffle, chunk_kb in itertools.product(args.complibs, args.levels, args.shuffles, args.chunk_kb):
+            if shuffle == "bit" and not gen_h5.bitshuffle_supported(compression_library):
+                # a "bit" row of any other compressor would measure no shuffle at all.
+                continue
+            output_path = os.path.join(work_path, "bench.h5")
+            result = bench(input_path, output_path, compression_library, compression_level, shuffle, chunk_kb or None, args.symbol_samples)
+            os.remove(output_path)
+            logging.info(result)
+            results.append(result)
+
+        write_report(args.o, results)
+    finally:
+        shutil.rmtree(work_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    main()
@@ -0,0 +1,291 @@
+import argparse
+import datetime
+import logging
+import os
+import sqlite3
+import typing
+
+import numpy as np
+import tables
+
+import day_format
+
+CATALOG_PATH = "/tank/iex/h5/catalog.db"
+SCAN_ROWS = 4 * 1024 * 1024
+
+
+class RowSymbolFile:
+    def __init__(
+        self,
+        path: str,
+        date: str,
+        table_name: str,
+        symbol: str,
+        rows: int,
+        byte_size: int,
+        min_timestamp: int,
+        max_timestamp: int,
+    ):
+        self.path = path
+        self.date = date
+        self.table_name = table_name
+        self.symbol = symbol
+        self.rows = rows
+        self.byte_size = byte_size
+        self.min_timestamp = min_timestamp
+        self.max_timestamp = max_timestamp
+
+
+def symbol_timestamps(table: tables.Table, symbol_index: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    First and last timestamp of every symbol of a day table, in one sequential pass over the timestamp column.
+    """
+    first_rows = symbol_index["start"]
+    last_rows = symbol_index["stop"] - 1
+    min_timestamps = np.zeros(len(symbol_index), dtype=np.uint64)
+    max_timestamps = np.zeros(len(symbol_index), dtype=np.uint64)
+    for start in range(0, table.nrows, SCAN_ROWS):
+        timestamps = table.read(start, start + SCAN_ROWS, field="timestamp")
+        stop = start + len(timestamps)
+        for rows, out in ((first_rows, min_timestamps), (last_rows, max_timestamps)):
+            selected = (rows >= start) & (rows < stop)
+            out[selected] = timestamps[rows[selected] - start]
+    return min_timestamps, max_timestamps
+
+
+def table_filters(table: tables.Table) -> typing.Tuple[str, int, str]:
+    filters = table.filters
+    shuffle = "bit" if filters.bitshuffle else "byte" if filters.shuffle else "none"
+    return filters.complib, filters.complevel, shuffle
+
+
+def legacy_symbol_entries(table: tables.Table) -> typing.Tuple[int, int, int, int]:
+    """
+    rows, byte size, first and last timestamp of a symbol table of a legacy file.
+    """
+    min_timestamp = max_timestamp = 0
+    for data in day_format.iter_legacy_rows(table, SCAN_ROWS):
+        if min_timestamp == 0:
+            min_timestamp = int(data["timestamp"][0])
+        max_timestamp = int(data["timestamp"][-1])
+    return int(table.nrows), int(table.size_on_disk), min_timestamp, max_timestamp
+
+
+def file_date(h5_path: str) -> str:
+    # day files are named after their date, /tank/iex/h5/<YYYYMMDD>.h5.
+    stem = os.path.splitext(os.path.basename(h5_path))[0]
+    datetime.datetime.strptime(stem, "%Y%m%d")
+    return stem
+
+
+class Catalog:
+    """
+    Manifest of the day files: what every file holds per table and symbol, and how it is compressed.
+    """
+
+    def __init__(self, database_path: str = CATALOG_PATH):
+        # conversions of different days may record their files at the same time.
+        self.connection = sqlite3.Connection(database_path, timeout=60)
+        self.init()
+
+    def init(self):
+        cursor = self.connection.cursor()
+
+        cursor.execute("""
+CREATE TABLE IF NOT EXISTS "files" (
+    "path" TEXT NOT NULL PRIMARY KEY,
+    "date" TEXT NOT NULL,
+    "byte_size" INTEGER NOT NULL,
+    "mtime_ns" INTEGER NOT NULL,
+    "format_version" INTEGER NOT NULL,
+    "recorded_at" TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+""")
+
+        cursor.execute("""
+CREATE TABLE IF NOT EXISTS "file_tables" (
+    "path" TEXT NOT NULL,
+    "table_name" TEXT NOT NULL,
+    "rows" INTEGER NOT NULL,
+    "byte_size" INTEGER NOT NULL,
+    "complib" TEXT,
+    "complevel" INTEGER NOT NULL,
+    "shuffle" TEXT NOT NULL,
+    "chunk_rows" INTEGER NOT NULL,
+    PRIMARY KEY ("path", "table_name"),
+    FOREIGN KEY ("path") REFERENCES files('path')
+);
+""")
+
+        # byte_size of a symbol is its share of the table's compressed size, by row count, or the size of its
+        # own table in legacy files.
+        cursor.execute("""
+CREATE TABLE IF NOT EXISTS "symbols" (
+    "path" TEXT NOT NULL,
+    "table_name" TEXT NOT NULL,
+    "symbol" TEXT NOT NULL,
+    "rows" INTEGER NOT NULL,
+    "byte_size" INTEGER NOT NULL,
+    "min_timestamp" INTEGER NOT NULL,
+    "max_timestamp" INTEGER NOT NULL,
+    PRIMARY KEY ("path", "table_name", "symbol"),
+    FOREIGN KEY ("path") REFERENCES files('path')
+);
+""")
+
+        cursor.execute("""
+CREATE INDEX IF NOT EXISTS "symbols_by_symbol" ON "symbols" ("symbol", "table_name", "min_timestamp");
+""")
+
+        self.connection.commit()
+
+    def record_file(self, h5_path: str):
+        """
+        Scan a day file and replace whatever the catalog knew about it.
+        """
+        h5_path = os.path.abspath(h5_path)
+        stat = os.stat(h5_path)
+        date = file_date(h5_path)
+        file_tables = []
+        symbols = []
+
+        with tables.open_file(h5_path, "r") as h5_file:
+            format_version = day_format.format_version(h5_file)
+            for table_name in day_format.TABLES:
+                if format_version == day_format.LEGACY_FORMAT_VERSION:
+                    symbol_tables = day_format.legacy_symbol_tables(h5_file, table_name)
+                    if not symbol_tables:
+                        continue
+                    entries = [(symbol_bytes, *legacy_symbol_entries(table)) for symbol_bytes, table in symbol_tables]
+                    nrows = sum(entry[1] for entry in entries)
+                    byte_size = sum(entry[2] for entry in entries)
+                    # one table per symbol, there is no single chunk shape.
+                    file_tables.append((h5_path, table_name, nrows, byte_size, *table_filters(symbol_tables[0][1]), 0))
+                    for symbol_bytes, rows, symbol_byte_size, min_timestamp, max_timestamp in entries:
+                        symbols.append((h5_path, table_name, symbol_bytes.decode().rstrip(), rows, symbol_byte_size, min_timestamp, max_timestamp))
+                    continue
+
+                if f"/{table_name}" not in h5_file:
+                    continue
+                table = h5_file.get_node(f"/{table_name}")
+                # sqlite3 does not bind numpy integers.
+                nrows, byte_size = int(table.nrows), int(table.size_on_disk)
+                file_tables.append((h5_path, table_name, nrows, byte_size, *table_filters(table), int(table.chunkshape[0])))
+
+                symbol_index = day_format.read_symbol_index(h5_file, table_name)
+                min_timestamps, max_timestamps = symbol_timestamps(table, symbol_index)
+                for (symbol_bytes, start, stop), min_timestamp, max_timestamp in zip(symbol_index.tolist(), min_timestamps.tolist(), max_timestamps.tolist()):
+                    rows = stop - start
+                    symbols.append((h5_path, table_name, symbol_bytes.decode().rstrip(), rows, byte_size * rows // max(nrows, 1), min_timestamp, max_timestamp))
+
+        if not file_tables:
+            raise ValueError(f"{h5_path} holds none of the day tables")
+
+        cursor = self.connection.cursor()
+        for table in ("symbols", "file_tables", "files"):
+            cursor.execute(f'DELETE FROM "{table}" WHERE "path" = ?;', (h5_path,))
+        cursor.execute(
+            """
+INSERT INTO
+"files"
+("path", "date", "byte_size", "mtime_ns", "format_version")
+VALUES
+(?, ?, ?, ?, ?);
+""",
+            (h5_path, date, stat.st_size, stat.st_mtime_ns, format_version),
+        )
+        cursor.executemany(
+            """
+INSERT INTO
+"file_tables"
+("path", "table_name", "rows", "byte_size", "complib", "complevel", "shuffle", "chunk_rows")
+VALUES
+(?, ?, ?, ?, ?, ?, ?, ?);
+""",
+            file_tables,
+        )
+        cursor.executemany(
+            """
+INSERT INTO
+"symbols"
+("path", "table_name", "symbol", "rows", "byte_size", "min_timestamp", "max_timestamp")
+VALUES
+(?, ?, ?, ?, ?, ?, ?);
+""",
+            symbols,
+        )
+        self.connection.commit()
+        logging.info(f"recorded {h5_path}: {len(symbols)} symbol tables")
+
+    def find(
+        self,
+        symbol: typing.Optional[str] = None,
+        table_name: typing.Optional[str] = None,
+        t0: typing.Optional[int] = None,
+        t1: typing.Optional[int] = None,
+        start_date: typing.Optional[str] = None,
+        end_date: typing.Optional[str] = None,
+    ) -> typing.List[RowSymbolFile]:
+        """
+        The (file, table, symbol) entries with rows in `t0 <= timestamp < t1` and `start_date <= date <= end_date`,
+        ordered by date. Every argument left to None is not filtered on.
+        """
+        conditions = []
+        parameters = []
+        for condition, parameter in (
+            ('"symbols"."symbol" = ?', symbol),
+            ('"symbols"."table_name" = ?', table_name),
+            ('"symbols"."max_timestamp" >= ?', t0),
+            ('"symbols"."min_timestamp" < ?', t1),
+            ('"files"."date" >= ?', start_date),
+            ('"files"."date" <= ?', end_date),
+        ):
+            if parameter is not None:
+                conditions.append(condition)
+                parameters.append(parameter)
+
+        cursor = self.connection.cursor()
+        cursor.execute(
+            f"""
+SELECT
+"symbols"."path", "files"."date", "symbols"."table_name", "symbols"."symbol", "symbols"."rows", "symbols"."byte_size", "symbols"."min_timestamp", "symbols"."max_timestamp"
+FROM "symbols"
+JOIN "files" ON "files"."path" = "symbols"."path"
+{"WHERE " + " AND ".join(conditions) if conditions else ""}
+ORDER BY "files"."date", "symbols"."table_name", "symbols"."symbol";
+""",
+            parameters,
+        )
+        return [RowSymbolFile(*row) for row in cursor.fetchall()]
+
+    def find_paths(self, *args, **kwargs) -> typing.List[str]:
+        return list(dict.fromkeys(row.path for row in self.find(*args, **kwargs)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", type=str, default=CATALOG_PATH)
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    add_parser = subparsers.add_parser("add", help="record day files")
+    add_parser.add_argument("paths", type=str, nargs="+")
+    find_parser = subparsers.add_parser("find", help="list the day files holding a symbol")
+    find_parser.add_argument("--symbol", type=str, default=None)
+    find_parser.add_argument("--table", type=str, default=None, choices=list(day_format.TABLES))
+    find_parser.add_argument("--t0", type=int, default=None, help="nanoseconds since the epoch")
+    find_parser.add_argument("--t1", type=int, default=None)
+    find_parser.add_argument("--start-date", type=str, default=None, help="YYYYMMDD")
+    find_parser.add_argument("--end-date", type=str, default=None)
+    args = parser.parse_args()
+
+    catalog = Catalog(args.db)
+    if args.action == "add":
+        for path in args.paths:
+            catalog.record_file(path)
+    else:
+        for row in catalog.find(args.symbol, args.table, args.t0, args.t1, args.start_date, args.end_date):
+            print(row.date, row.path, row.table_name, row.symbol, row.rows, row.min_timestamp, row.max_timestamp)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    main()
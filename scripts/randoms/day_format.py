@@ -0,0 +1,266 @@
+import bisect
+import typing
+
+import numpy as np
+import tables
+
+from dtypes import trade_report_message_dtype, quote_update_message_dtype
+
+# One HDF5 file per day:
+#   /<table_name>               every symbol's rows in one table, sorted by (symbol, timestamp)
+#   /symbol_index/<table_name>  symbol -> [start, stop) rows of that table
+#   /timestamp_index/<table_name>  timestamp of the first row of every chunk of that table
+#   /quote_snapshots/...        optional top of book snapshots, see snapshots.py
+FORMAT_VERSION = 2
+
+# Files written before that layout have no day_format_version attribute and one group per symbol:
+#   /<symbol>/<table_name>.bin  the rows of one symbol in stream order
+LEGACY_FORMAT_VERSION = 0
+
+TABLES = {
+    "trade_report_message": trade_report_message_dtype,
+    "quote_update_message": quote_update_message_dtype,
+}
+
+symbol_index_dtype = np.dtype(
+    [
+        ("symbol", "S8"),
+        ("start", "<i8"),
+        ("stop", "<i8"),
+    ]
+)
+
+
+def pad_symbol(symbol: str) -> bytes:
+    # IEX pads symbols with spaces, which sort below every character allowed in a symbol.
+    return symbol.encode().ljust(8)
+
+
+def symbol_u64(symbols: np.ndarray) -> np.ndarray:
+    # big-endian so that the integer order is the lexicographic order of the symbols.
+    return np.ascontiguousarray(symbols, dtype="S8").view(">u8")
+
+
+def sort_rows(data: np.ndarray) -> np.ndarray:
+    return data[np.lexsort((data["timestamp"], symbol_u64(data["symbol"])))]
+
+
+class DayWriter:
+    """
+    Append rows to one sorted day table, a symbol at a time.
+
+    Symbols must be appended in increasing order and the rows of a symbol in increasing timestamp order,
+    which is what a stream-ordered source split per symbol gives. A symbol may span several appends.
+    """
+
+    def __init__(
+        self,
+        h5_file: tables.File,
+        table_name: str,
+        filters: tables.Filters,
+        expectedrows: int = 10_000,
+        chunkshape: typing.Optional[int] = None,
+    ):
+        self.h5_file = h5_file
+        self.table_name = table_name
+        self.table = h5_file.create_table(
+            where="/",
+            name=table_name,
+            description=TABLES[table_name],
+            filters=filters,
+            expectedrows=max(expectedrows, 1),
+            chunkshape=None if chunkshape is None else (chunkshape,),
+        )
+        self.index = []
+        self.chunk_timestamps = []
+        h5_file.root._v_attrs.day_format_version = FORMAT_VERSION
+
+    def append(self, symbol: bytes, data: np.ndarray):
+        if len(data) == 0:
+            return
+        if not np.all(data["timestamp"][1:] >= data["timestamp"][:-1]):
+            data = data[np.argsort(data["timestamp"], kind="stable")]
+
+        start = self.table.nrows
+        self.table.append(data)
+        chunk_rows = self.table.chunkshape[0]
+        self.chunk_timestamps.append(data["timestamp"][-start % chunk_rows :: chunk_rows])
+        if self.index and self.index[-1][0] == symbol:
+            self.index[-1] = (symbol, self.index[-1][1], self.table.nrows)
+        else:
+            assert not self.index or self.index[-1][0] < symbol, f"{symbol} appended after {self.index[-1][0]}"
+            self.index.append((symbol, start, self.table.nrows))
+
+    def close(self):
+        self.table.flush()
+        write_symbol_index(self.h5_file, self.table_name, self.index)
+        write_timestamp_index(self.h5_file, self.table_name, np.concatenate(self.chunk_timestamps or [np.empty(0, dtype=np.uint64)]))
+
+
+def write_symbol_index(h5_file: tables.File, table_name: str, index: typing.List[typing.Tuple[bytes, int, int]]):
+    h5_file.create_table(
+        where="/symbol_index",
+        name=table_name,
+        createparents=True,
+        obj=np.array(index, dtype=symbol_index_dtype),
+    )
+
+
+def write_timestamp_index(h5_file: tables.File, table_name: str, chunk_timestamps: np.ndarray):
+    h5_file.create_array(
+        where="/timestamp_index",
+        name=table_name,
+        createparents=True,
+        obj=np.asarray(chunk_timestamps, dtype=np.uint64),
+    )
+
+
+def read_symbol_index(h5_file: tables.File, table_name: str) -> np.ndarray:
+    """
+    symbol -> [start, stop) rows of a table. A legacy file has a table per symbol, there the rows are those
+    of the symbol's own table, see `symbol_table`.
+    """
+    if format_version(h5_file) == LEGACY_FORMAT_VERSION:
+        return np.array([(symbol, 0, table.nrows) for symbol, table in legacy_symbol_tables(h5_file, table_name)], dtype=symbol_index_dtype)
+    return h5_file.get_node(f"/symbol_index/{table_name}").read()
+
+
+def has_table(h5_file: tables.File, table_name: str) -> bool:
+    if format_version(h5_file) == LEGACY_FORMAT_VERSION:
+        return bool(legacy_symbol_tables(h5_file, table_name))
+    return f"/{table_name}" in h5_file
+
+
+def list_symbols(h5_file: tables.File, table_name: str) -> typing.List[str]:
+    return [symbol.decode().rstrip() for symbol in read_symbol_index(h5_file, table_name)["symbol"]]
+
+
+def symbol_range(symbol_index: np.ndarray, symbol: str) -> typing.Tuple[int, int]:
+    symbol_bytes = pad_symbol(symbol)
+    i = np.searchsorted(symbol_index["symbol"], symbol_bytes)
+    if i == len(symbol_index) or symbol_index["symbol"][i] != symbol_bytes:
+        return 0, 0
+    return int(symbol_index["start"][i]), int(symbol_index["stop"][i])
+
+
+def symbol_table(
+    h5_file: tables.File,
+    table_name: str,
+    symbol: str,
+    symbol_index: typing.Optional[np.ndarray] = None,
+) -> typing.Tuple[typing.Optional[tables.Table], int, int]:
+    """
+    The table holding the rows of `symbol` and the [start, stop) rows of the symbol in it, in either layout.
+    The table is None when a legacy file has no table for the symbol.
+    """
+    if format_version(h5_file) == LEGACY_FORMAT_VERSION:
+        path = f"/{symbol}/{table_name}.bin"
+        if path not in h5_file:
+            return None, 0, 0
+        table = h5_file.get_node(path)
+        return table, 0, int(table.nrows)
+    if symbol_index is None:
+        symbol_index = read_symbol_index(h5_file, table_name)
+    return h5_file.get_node(f"/{table_name}"), *symbol_range(symbol_index, symbol)
+
+
+def read_symbol(h5_file: tables.File, table_name: str, symbol: str, symbol_index: typing.Optional[np.ndarray] = None) -> np.ndarray:
+    table, start, stop = symbol_table(h5_file, table_name, symbol, symbol_index)
+    if table is None:
+        return np.empty(0, dtype=TABLES[table_name])
+    return table.read(start, stop)
+
+
+class ChunkTimestamps:
+    """
+    First timestamp of every chunk of a table, read one row at a time for tables without a timestamp index:
+    those of files written before it and the symbol tables of legacy files.
+    """
+
+    def __init__(self, table: tables.Table):
+        self.table = table
+        self.chunk_rows = table.chunkshape[0]
+
+    def __getitem__(self, chunk: int) -> int:
+        row = chunk * self.chunk_rows
+        return self.table.read(row, row + 1, field="timestamp")[0]
+
+
+def read_chunk_timestamps(h5_file: tables.File, table_name: str, table: typing.Optional[tables.Table] = None):
+    """
+    Chunk timestamps of `table`, by default the day table `table_name`; pass the symbol table of a legacy file.
+    """
+    if f"/timestamp_index/{table_name}" in h5_file:
+        return h5_file.get_node(f"/timestamp_index/{table_name}").read()
+    return ChunkTimestamps(h5_file.get_node(f"/{table_name}") if table is None else table)
+
+
+def timestamp_row(table: tables.Table, chunk_timestamps, start: int, stop: int, timestamp: int) -> int:
+    """
+    First row in `start..stop` whose timestamp is at least `timestamp`, the rows being sorted by timestamp.
+
+    The chunk timestamps narrow the search down to one chunk, which is the only one decompressed.
+    """
+    if start >= stop:
+        return start
+    # the archive timestamps are uint64, comparing them with int64 would go through float64.
+    timestamp = np.uint64(max(int(timestamp), 0))
+    chunk_rows = table.chunkshape[0]
+    # chunks `first..last` start inside (start, stop).
+    first = start // chunk_rows + 1
+    last = (stop - 1) // chunk_rows + 1
+    chunk = bisect.bisect_left(chunk_timestamps, timestamp, first, last)
+    lo = start if chunk == first else (chunk - 1) * chunk_rows
+    hi = stop if chunk == last else chunk * chunk_rows
+    return lo + int(np.searchsorted(table.read(lo, hi, field="timestamp"), timestamp, side="left"))
+
+
+def symbol_time_range(h5_file: tables.File, table_name: str, symbol: str, t0: int, t1: int) -> typing.Tuple[typing.Optional[tables.Table], int, int]:
+    """
+    The table holding the rows of `symbol` and the rows of the symbol in it with `t0 <= timestamp < t1`,
+    see `symbol_table`.
+    """
+    table, start, stop = symbol_table(h5_file, table_name, symbol)
+    if table is None:
+        return None, 0, 0
+    # the symbol table of a legacy file has no timestamp index and its chunk timestamps are read lazily.
+    chunk_timestamps = read_chunk_timestamps(h5_file, table_name, table)
+    return table, timestamp_row(table, chunk_timestamps, start, stop, t0), timestamp_row(table, chunk_timestamps, start, stop, t1)
+
+
+def read_symbol_time_range(h5_file: tables.File, table_name: str, symbol: str, t0: int, t1: int) -> np.ndarray:
+    table, start, stop = symbol_time_range(h5_file, table_name, symbol, t0, t1)
+    if table is None:
+        return np.empty(0, dtype=TABLES[table_name])
+    return table.read(start, stop)
+
+
+def format_version(h5_file: tables.File) -> int:
+    return int(getattr(h5_file.root._v_attrs, "day_format_version", LEGACY_FORMAT_VERSION))
+
+
+def legacy_symbol_tables(h5_file: tables.File, table_name: str) -> typing.List[typing.Tuple[bytes, tables.Table]]:
+    """
+    (padded symbol, table) of every symbol group of a legacy file holding `table_name`, sorted by symbol.
+    """
+    symbol_tables = []
+    for group in h5_file.iter_nodes("/", classname="Group"):
+        path = f"{group._v_pathname}/{table_name}.bin"
+        if path in h5_file:
+            symbol_tables.append((pad_symbol(group._v_name), h5_file.get_node(path)))
+    return sorted(symbol_tables, key=lambda symbol_table: symbol_table[0])
+
+
+def iter_legacy_rows(table: tables.Table, chunk_rows: int) -> typing.Iterator[np.ndarray]:
+    """
+    The rows of a legacy symbol table, `chunk_rows` at a time. They are in stream order, which is timestamp
+    order, and anything else is an error rather than silently unsorted output.
+    """
+    last_timestamp = np.uint64(0)
+    for start in range(0, table.nrows, chunk_rows):
+        data = table.read(start, start + chunk_rows)
+        timestamps = data["timestamp"]
+        if timestamps[0] < last_timestamp or not np.all(timestamps[1:] >= timestamps[:-1]):
+            raise ValueError(f"{table._v_file.filename}:{table._v_pathname} is not sorted by timestamp")
+        last_timestamp = timestamps[-1]
+        yield data
@@ -0,0 +1,148 @@
+import argparse
+import glob
+import logging
+import multiprocessing
+import os
+import typing
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import tables
+
+import day_format
+
+PARQUET_ROOT = "/tank/iex/parquet"
+ROW_GROUP_ROWS = 1024 * 1024
+
+
+def parquet_path(parquet_root: str, table_name: str, date: str) -> str:
+    # hive-style partitions, so engines see `date` as a column and prune on it.
+    return os.path.join(parquet_root, table_name, f"date={date}", "part-0.parquet")
+
+
+def to_record_batch(data: np.ndarray, symbols: pa.Array, symbol_ids: np.ndarray) -> pa.RecordBatch:
+    columns = []
+    names = []
+    for name in data.dtype.names:
+        if name == "symbol":
+            column = pa.DictionaryArray.from_arrays(pa.array(symbol_ids, type=pa.int32()), symbols)
+        elif name == "timestamp":
+            column = pa.array(np.ascontiguousarray(data[name]).view(np.int64), type=pa.timestamp("ns", tz="UTC"))
+        else:
+            column = pa.array(np.ascontiguousarray(data[name]))
+        columns.append(column)
+        names.append(name)
+    return pa.RecordBatch.from_arrays(columns, names=names)
+
+
+def iter_table_batches(table: tables.Table, symbol_stops: np.ndarray, batch_rows: int) -> typing.Iterator[typing.Tuple[np.ndarray, np.ndarray]]:
+    for start in range(0, table.nrows, batch_rows):
+        data = table.read(start, start + batch_rows)
+        symbol_ids = np.searchsorted(symbol_stops, np.arange(start, start + len(data)), side="right").astype(np.int32)
+        yield data, symbol_ids
+
+
+def iter_legacy_batches(symbol_tables: typing.List[typing.Tuple[bytes, tables.Table]], batch_rows: int) -> typing.Iterator[typing.Tuple[np.ndarray, np.ndarray]]:
+    # the symbol tables are chained in symbol order and cut again into batches of `batch_rows`.
+    pieces = []
+    piece_ids = []
+    buffered = 0
+    for symbol_id, (_, table) in enumerate(symbol_tables):
+        for data in day_format.iter_legacy_rows(table, batch_rows):
+            while len(data):
+                piece = data[: batch_rows - buffered]
+                data = data[len(piece) :]
+                pieces.append(piece)
+                piece_ids.append(np.full(len(piece), symbol_id, dtype=np.int32))
+                buffered += len(piece)
+                if buffered == batch_rows:
+                    yield np.concatenate(pieces), np.concatenate(piece_ids)
+                    pieces, piece_ids, buffered = [], [], 0
+    if buffered:
+        yield np.concatenate(pieces), np.concatenate(piece_ids)
+
+
+def read_day_table(h5_file: tables.File, table_name: str, batch_rows: int) -> typing.Tuple[typing.List[bytes], typing.Iterator[typing.Tuple[np.ndarray, np.ndarray]]]:
+    """
+    The symbols of a day table, and its rows in (symbol, timestamp) order `batch_rows` at a time along with the
+    position of every row's symbol. Legacy files are read symbol group by symbol group.
+    """
+    if day_format.format_version(h5_file) == day_format.LEGACY_FORMAT_VERSION:
+        symbol_tables = day_format.legacy_symbol_tables(h5_file, table_name)
+        return [symbol_bytes for symbol_bytes, _ in symbol_tables], iter_legacy_batches(symbol_tables, batch_rows)
+    symbol_index = day_format.read_symbol_index(h5_file, table_name)
+    return symbol_index["symbol"].tolist(), iter_table_batches(h5_file.get_node(f"/{table_name}"), symbol_index["stop"], batch_rows)
+
+
+def export_table(h5_path: str, table_name: str, output_path: str, compression: str = "zstd", row_group_rows: int = ROW_GROUP_ROWS):
+    """
+    Copy one day table to Parquet, one row group per `row_group_rows` rows.
+
+    The rows come out sorted by (symbol, timestamp), so the row groups get narrow symbol and timestamp min/max
+    statistics. Symbols are dictionary encoded from the day's symbol list instead of being hashed.
+    """
+    with tables.open_file(h5_path, "r") as h5_file:
+        symbol_list, batches = read_day_table(h5_file, table_name, row_group_rows)
+        symbols = pa.array([symbol.decode().rstrip() for symbol in symbol_list], type=pa.string())
+
+        schema = to_record_batch(np.empty(0, dtype=day_format.TABLES[table_name]), symbols, np.empty(0, dtype=np.int32)).schema
+        with pq.ParquetWriter(output_path, schema, compression=compression, use_dictionary=["symbol"], write_statistics=True) as writer:
+            for data, symbol_ids in batches:
+                writer.write_batch(to_record_batch(data, symbols, symbol_ids), row_group_size=row_group_rows)
+
+
+def export_day(task) -> str:
+    h5_path, parquet_root, compression, row_group_rows, overwrite = task
+    date = os.path.splitext(os.path.basename(h5_path))[0]
+    for table_name in day_format.TABLES:
+        output_path = parquet_path(parquet_root, table_name, date)
+        if os.path.exists(output_path) and not overwrite:
+            continue
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        # written aside and renamed, so an interrupted backfill never leaves a truncated partition.
+        tmp_path = f"{output_path}.tmp"
+        export_table(h5_path, table_name, tmp_path, compression, row_group_rows)
+        os.replace(tmp_path, output_path)
+    return h5_path
+
+
+def backfill(
+    h5_paths: typing.List[str],
+    parquet_root: str,
+    workers: int,
+    compression: str = "zstd",
+    row_group_rows: int = ROW_GROUP_ROWS,
+    overwrite: bool = False,
+):
+    tasks = [(h5_path, parquet_root, compression, row_group_rows, overwrite) for h5_path in sorted(h5_paths)]
+    with multiprocessing.Pool(processes=workers) as pool:
+        for h5_path in pool.imap_unordered(export_day, tasks):
+            logging.info(f"exported {h5_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", type=str, nargs="+", required=True, help="day files, or a directory of them to backfill")
+    parser.add_argument("-o", type=str, default=PARQUET_ROOT)
+    parser.add_argument("--compression", type=str, default="zstd")
+    parser.add_argument("--row-group-rows", type=int, default=ROW_GROUP_ROWS)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--overwrite", action="store_true")
+    args = parser.parse_args()
+
+    h5_paths = []
+    for path in args.i:
+        h5_paths.extend(sorted(glob.glob(os.path.join(path, "*.h5"))) if os.path.isdir(path) else [path])
+
+    if args.workers > 1:
+        backfill(h5_paths, args.o, args.workers, args.compression, args.row_group_rows, args.overwrite)
+    else:
+        for h5_path in h5_paths:
+            export_day((h5_path, args.o, args.compression, args.row_group_rows, args.overwrite))
+            logging.info(f"exported {h5_path}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    main()
@@ -1,8 +1,14 @@
+import collections
+import itertools
+import multiprocessing
 import os
+import typing
 import numpy as np
 import tables
 import argparse
 
+import catalog
+import day_format
 from dtypes import trade_report_message_dtype, quote_update_message_dtype
 
 
@@ -14,42 +20,210 @@ def get_dtype_from_filename(filename: str):
     assert False
 
 
-def run(input_path: str, output_path: str, compression_level: int, compression_library: str):
+MEMORY_BYTES = 256 * 1024 * 1024
+SHUFFLES = ["none", "byte", "bit"]
+
+
+def bitshuffle_supported(compression_library: str) -> bool:
+    # the blosc (v1) filter of some PyTables builds ignores bitshuffle and writes unshuffled chunks, only
+    # blosc2 applies it reliably.
+    return compression_library.startswith("blosc2")
+
+
+def make_filters(compression_level: int, compression_library: str, shuffle: str = "byte") -> tables.Filters:
+    if shuffle == "bit" and not bitshuffle_supported(compression_library):
+        raise ValueError(f"bitshuffle needs a blosc2 compressor, not {compression_library}")
+    return tables.Filters(
+        complevel=compression_level,
+        complib=compression_library,
+        shuffle=shuffle == "byte",
+        bitshuffle=shuffle == "bit",
+    )
+
+
+def iter_records(binary_path: str, file_dtype: np.dtype, chunk_rows: int) -> typing.Iterator[np.ndarray]:
+    with open(binary_path, "rb") as f:
+        while True:
+            data = np.fromfile(f, dtype=file_dtype, count=chunk_rows)
+            if len(data) == 0:
+                break
+            yield data
+
+
+def run(
+    input_path: str,
+    output_path: str,
+    compression_level: int,
+    compression_library: str,
+    memory_bytes: int = MEMORY_BYTES,
+    chunk_bytes: typing.Optional[int] = None,
+    shuffle: str = "byte",
+):
+    filters = make_filters(compression_level, compression_library, shuffle)
+    symbols = sorted(os.listdir(input_path), key=day_format.pad_symbol)
+
     with tables.open_file(output_path, "w") as h5_file:
-        # Iterate over all files in the input directory
-        for symbol in os.listdir(input_path):
-            for filename in os.listdir(os.path.join(input_path, symbol)):
-                binary_path = os.path.join(input_path, symbol, filename)
+        for table_name in day_format.TABLES:
+            filename = f"{table_name}.bin"
+            file_dtype = get_dtype_from_filename(filename)
+            binary_paths = [(symbol, os.path.join(input_path, symbol, filename)) for symbol in symbols]
+            binary_paths = [(symbol, binary_path) for symbol, binary_path in binary_paths if os.path.exists(binary_path)]
+
+            # at most `memory_bytes` of records are read at once, however large the symbol's file is.
+            chunk_rows = max(memory_bytes // file_dtype.itemsize, 1)
+            chunkshape = None if chunk_bytes is None else max(chunk_bytes // file_dtype.itemsize, 1)
+            expectedrows = sum(os.path.getsize(binary_path) // file_dtype.itemsize for _, binary_path in binary_paths)
+
+            writer = day_format.DayWriter(h5_file, table_name, filters, expectedrows, chunkshape)
+            for symbol, binary_path in binary_paths:
                 # print(binary_path)
-                file_dtype = get_dtype_from_filename(filename)
-                # print(file_dtype)
-                data = np.fromfile(binary_path, dtype=file_dtype)
-                h5_file.create_table(
-                    where=f"/{symbol}",
-                    name=f"{filename}",
-                    createparents=True,
-                    filters=tables.Filters(
-                        complevel=compression_level,
-                        complib=compression_library,
-                        shuffle=True,
-                    ),
-                    # description=file_dtype,
-                    obj=data,
-                )
+                for data in iter_records(binary_path, file_dtype, chunk_rows):
+                    writer.append(day_format.pad_symbol(symbol), data)
+            writer.close()
+
+
+def compress_rows(task) -> typing.Tuple[str, typing.List[typing.Tuple[int, bytes, int, int]]]:
+    """
+    Read rows `start..stop` of a day table from the per-symbol files and push them through the HDF5 filters.
+
+    The rows are appended to an in-memory table with the output's filters and chunk shape, so the raw chunks
+    read back from it can be written as-is into the output with `write_chunk`.
+    """
+    table_name, start, stop, sources, compression_level, compression_library, shuffle, chunkshape = task
+    file_dtype = day_format.TABLES[table_name]
+
+    data = np.empty(stop - start, dtype=file_dtype)
+    for binary_path, file_row, rows, row in sources:
+        part = np.fromfile(binary_path, dtype=file_dtype, count=rows, offset=file_row * file_dtype.itemsize)
+        if not np.all(part["timestamp"][1:] >= part["timestamp"][:-1]):
+            part = part[np.argsort(part["timestamp"], kind="stable")]
+        data[row - start : row - start + rows] = part
+
+    filters = make_filters(compression_level, compression_library, shuffle)
+    with tables.open_file(f"{table_name}-{start}.h5", "w", driver="H5FD_CORE", driver_core_backing_store=0) as h5_file:
+        table = h5_file.create_table(where="/", name=table_name, description=file_dtype, filters=filters, chunkshape=(chunkshape,))
+        table.append(data)
+        table.flush()
+        chunks = []
+        for row in range(0, len(data), chunkshape):
+            chunks.append((start + row, bytes(table.read_chunk((row,))), table.chunk_info((row,)).filter_mask, data["timestamp"][row]))
+    return table_name, chunks
+
+
+def run_parallel(
+    input_path: str,
+    output_path: str,
+    compression_level: int,
+    compression_library: str,
+    workers: int,
+    memory_bytes: int = MEMORY_BYTES,
+    chunk_bytes: typing.Optional[int] = None,
+    shuffle: str = "byte",
+):
+    """
+    Compress in a pool of `workers` processes while this process stays the only writer of the HDF5 file.
+
+    The symbol layout of every table is known from the raw file sizes, so the table is sized up front and
+    split into chunk-aligned row ranges of at most `memory_bytes / workers` each. Workers return compressed
+    chunks, and only `2 * workers` ranges are in flight at a time, so results cannot pile up in this process when
+    the writer falls behind.
+    """
+    filters = make_filters(compression_level, compression_library, shuffle)
+    symbols = sorted(os.listdir(input_path), key=day_format.pad_symbol)
+
+    with tables.open_file(output_path, "w") as h5_file, multiprocessing.Pool(processes=workers) as pool:
+        h5_tables = {}
+        chunk_timestamps = {}
+        tasks = []
+        for table_name in day_format.TABLES:
+            filename = f"{table_name}.bin"
+            file_dtype = get_dtype_from_filename(filename)
+            binary_paths = [(symbol, os.path.join(input_path, symbol, filename)) for symbol in symbols]
+            binary_paths = [(symbol, binary_path, os.path.getsize(binary_path) // file_dtype.itemsize) for symbol, binary_path in binary_paths if os.path.exists(binary_path)]
+            binary_paths = [(symbol, binary_path, rows) for symbol, binary_path, rows in binary_paths if rows > 0]
+
+            index = []
+            row = 0
+            for symbol, binary_path, rows in binary_paths:
+                index.append((day_format.pad_symbol(symbol), row, row + rows))
+                row += rows
+            total_rows = row
+
+            table = h5_file.create_table(
+                where="/",
+                name=table_name,
+                description=file_dtype,
+                filters=filters,
+                expectedrows=max(total_rows, 1),
+                chunkshape=None if chunk_bytes is None else (max(chunk_bytes // file_dtype.itemsize, 1),),
+            )
+            table.truncate(total_rows)
+            h5_tables[table_name] = table
+            day_format.write_symbol_index(h5_file, table_name, index)
+
+            chunkshape = table.chunkshape[0]
+            chunk_timestamps[table_name] = np.empty(-(-total_rows // chunkshape), dtype=np.uint64)
+            task_rows = max(memory_bytes // workers // file_dtype.itemsize // chunkshape, 1) * chunkshape
+            symbol_stops = np.array([symbol_stop for _, _, symbol_stop in index], dtype=np.int64)
+            for start in range(0, total_rows, task_rows):
+                stop = min(start + task_rows, total_rows)
+                sources = []
+                i = np.searchsorted(symbol_stops, start, side="right")
+                while i < len(index) and index[i][1] < stop:
+                    _, symbol_start, symbol_stop = index[i]
+                    row = max(symbol_start, start)
+                    sources.append((binary_paths[i][1], row - symbol_start, min(symbol_stop, stop) - row, row))
+                    i += 1
+                tasks.append((table_name, start, stop, sources, compression_level, compression_library, shuffle, chunkshape))
+        h5_file.root._v_attrs.day_format_version = day_format.FORMAT_VERSION
+
+        tasks = iter(tasks)
+        pending = collections.deque(pool.apply_async(compress_rows, (task,)) for task in itertools.islice(tasks, 2 * workers))
+        while pending:
+            table_name, chunks = pending.popleft().get()
+            for task in itertools.islice(tasks, 1):
+                pending.append(pool.apply_async(compress_rows, (task,)))
+            table = h5_tables[table_name]
+            for row, chunk, filter_mask, timestamp in chunks:
+                table.write_chunk((row,), chunk, filter_mask)
+                chunk_timestamps[table_name][row // table.chunkshape[0]] = timestamp
+
+        for table_name, timestamps in chunk_timestamps.items():
+            day_format.write_timestamp_index(h5_file, table_name, timestamps)
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", type=str, required=True)
     parser.add_argument("-o", type=str, required=True)
+    parser.add_argument("--memory-mb", type=int, default=MEMORY_BYTES // (1024 * 1024))
+    parser.add_argument("--chunk-kb", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--catalog", type=str, default=None, help="record the output in this catalog database")
     args = parser.parse_args()
 
-    run(
-        args.i,
-        args.o,
-        5,
-        "blosc:zstd",
-    )
+    if args.workers > 1:
+        run_parallel(
+            args.i,
+            args.o,
+            5,
+            "blosc:zstd",
+            args.workers,
+            args.memory_mb * 1024 * 1024,
+            None if args.chunk_kb is None else args.chunk_kb * 1024,
+        )
+    else:
+        run(
+            args.i,
+            args.o,
+            5,
+            "blosc:zstd",
+            args.memory_mb * 1024 * 1024,
+            None if args.chunk_kb is None else args.chunk_kb * 1024,
+        )
+
+    if args.catalog is not None:
+        catalog.Catalog(args.catalog).record_file(args.o)
 
 
 if __name__ == "__main__":
@@ -1,45 +1,189 @@
+import collections
 import sys
-import random
 import pathlib
+import typing
 
-from PySide6 import QtCore, QtWidgets, QtGui
+import numpy as np
+import tables
+from PySide6 import QtCore, QtWidgets
 from PySide6.QtCore import Qt
-from PySide6.QtWidgets import QWidget, QPushButton, QLabel, QVBoxLayout, QFileDialog
+from PySide6.QtWidgets import QWidget, QPushButton, QLabel, QVBoxLayout, QHBoxLayout, QFileDialog, QListWidget, QComboBox, QTableView
+
+import day_format
 
 HOME_DIR = str(pathlib.Path.home().absolute())
+ALL_SYMBOLS = "(all)"
+
+# Rows are read from the tables CACHE_CHUNK_ROWS at a time, and at most CACHE_CHUNKS of those are kept.
+CACHE_CHUNK_ROWS = 4096
+CACHE_CHUNKS = 32
+
+
+class ChunkCache:
+    """
+    Least recently used row ranges of the tables of one file.
+    """
+
+    def __init__(self, max_chunks: int = CACHE_CHUNKS, chunk_rows: int = CACHE_CHUNK_ROWS):
+        self.max_chunks = max_chunks
+        self.chunk_rows = chunk_rows
+        self.chunks = collections.OrderedDict()
+
+    def row(self, table: tables.Table, row: int) -> np.void:
+        key = (table._v_pathname, row // self.chunk_rows)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            start = key[1] * self.chunk_rows
+            chunk = table.read(start, start + self.chunk_rows)
+            self.chunks[key] = chunk
+            if len(self.chunks) > self.max_chunks:
+                self.chunks.popitem(last=False)
+        else:
+            self.chunks.move_to_end(key)
+        return chunk[row % self.chunk_rows]
+
+    def clear(self):
+        self.chunks.clear()
+
+
+class H5TableModel(QtCore.QAbstractTableModel):
+    """
+    Rows `start..stop` of a PyTables table. The view only asks for the rows it shows, which are read through
+    the chunk cache, so the table size does not matter.
+    """
+
+    def __init__(self, table: tables.Table, start: int, stop: int, cache: ChunkCache, parent=None):
+        super().__init__(parent)
+        self.table = table
+        self.start = start
+        self.stop = stop
+        self.cache = cache
+        self.names = table.dtype.names
+
+    def rowCount(self, parent=QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else self.stop - self.start
+
+    def columnCount(self, parent=QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.names)
+
+    def data(self, index: QtCore.QModelIndex, role=Qt.DisplayRole) -> typing.Any:
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        name = self.names[index.column()]
+        value = self.cache.row(self.table, self.start + index.row())[name]
+        if name == "timestamp":
+            return str(np.datetime64(int(value), "ns"))
+        if isinstance(value, bytes):
+            return value.decode().rstrip()
+        return str(value)
+
+    def headerData(self, section: int, orientation, role=Qt.DisplayRole) -> typing.Any:
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.names[section]
+        return str(self.start + section)
 
 
 class MyWidget(QWidget):
     def __init__(self):
         super().__init__()
 
-        # self.hello = ["Hallo Welt", "Hei maailma", "Hola Mundo", "Привет мир"]
+        self.h5_file = None
+        self.cache = ChunkCache()
 
         self.button = QPushButton("Open File")
-        # self.text = QLabel(text="Hello World", alignment=Qt.AlignCenter)
-        # self.
+        self.text = QLabel(text="")
+        self.table_names = QComboBox()
+        self.symbols = QListWidget()
+        self.rows = QTableView()
+
+        browser = QHBoxLayout()
+        sidebar = QVBoxLayout()
+        sidebar.addWidget(self.table_names)
+        sidebar.addWidget(self.symbols)
+        browser.addLayout(sidebar, 1)
+        browser.addWidget(self.rows, 4)
 
         self.layout = QVBoxLayout(self)
-        # self.layout.addWidget(self.text)
         self.layout.addWidget(self.button)
+        self.layout.addWidget(self.text)
+        self.layout.addLayout(browser)
 
         self.button.clicked.connect(self.magic)
+        self.table_names.currentTextChanged.connect(self.show_rows)
+        self.symbols.currentTextChanged.connect(self.show_rows)
 
     @QtCore.Slot()
     def magic(self):
-        # self.text.setText(random.choice(self.hello))
         self.cb_open_file_dialog()
 
     def cb_open_file_dialog(self):
         file_name, file_type = QFileDialog.getOpenFileName(self, caption="Open Image", dir=HOME_DIR, filter="*.h5")
-        print(file_name, file_type)
+        if file_name:
+            self.open_path(file_name)
+
+    def open_path(self, path: str):
+        """
+        List the tables and symbols of a day file. Only the symbol indexes are read.
+        """
+        self.close_file()
+        self.h5_file = tables.open_file(path, "r")
+        table_names = [table_name for table_name in day_format.TABLES if day_format.has_table(self.h5_file, table_name)]
+        symbols = set()
+        for table_name in table_names:
+            symbols.update(day_format.list_symbols(self.h5_file, table_name))
+
+        # a file with none of the day tables would otherwise just show empty lists.
+        self.text.setText(path if table_names else f"{path}: none of the tables {', '.join(day_format.TABLES)}")
+        self.symbols.blockSignals(True)
+        self.table_names.blockSignals(True)
+        self.symbols.clear()
+        self.symbols.addItems([ALL_SYMBOLS] + sorted(symbols, key=day_format.pad_symbol))
+        self.table_names.clear()
+        self.table_names.addItems(table_names)
+        self.symbols.setCurrentRow(0)
+        self.symbols.blockSignals(False)
+        self.table_names.blockSignals(False)
+        self.show_rows()
+
+    def show_rows(self, *args):
+        table_name = self.table_names.currentText()
+        item = self.symbols.currentItem()
+        if self.h5_file is None or not table_name or item is None:
+            return
+        self.text.setText(self.h5_file.filename)
+        if item.text() != ALL_SYMBOLS:
+            table, start, stop = day_format.symbol_table(self.h5_file, table_name, item.text())
+        elif day_format.format_version(self.h5_file) == day_format.LEGACY_FORMAT_VERSION:
+            # a legacy file has a table per symbol and no table of all of them.
+            table, start, stop = None, 0, 0
+            self.text.setText(f"{self.h5_file.filename}: legacy layout, one table per symbol, pick a symbol")
+        else:
+            table = self.h5_file.get_node(f"/{table_name}")
+            start, stop = 0, table.nrows
+        self.rows.setModel(None if table is None else H5TableModel(table, start, stop, self.cache, self))
+
+    def close_file(self):
+        self.rows.setModel(None)
+        self.cache.clear()
+        if self.h5_file is not None:
+            self.h5_file.close()
+            self.h5_file = None
+
+    def closeEvent(self, event):
+        self.close_file()
+        super().closeEvent(event)
 
 
 if __name__ == "__main__":
+    # QT_QPA_PLATFORM=offscreen runs this without a display.
     app = QtWidgets.QApplication([])
 
     widget = MyWidget()
     widget.resize(800, 600)
+    if len(sys.argv) > 1:
+        widget.open_path(sys.argv[1])
     widget.show()
 
     sys.exit(app.exec())
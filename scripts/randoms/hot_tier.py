@@ -0,0 +1,156 @@
+import argparse
+import glob
+import logging
+import os
+import shutil
+import typing
+
+import numpy as np
+import tables
+
+import day_format
+
+# The hot tier keeps the busiest symbols of the latest days as raw columns that are memory mapped:
+#   <hot_root>/<date>/<table_name>/<column>.npy        the rows of the selected symbols, sorted by (symbol, timestamp)
+#   <hot_root>/<date>/<table_name>/symbol_index.npy    symbol -> [start, stop) rows, like the day file's symbol index
+# The symbol column is left out, the symbol index says which rows belong to which symbol.
+HOT_ROOT = "/tank/iex/hot"
+H5_ROOT = "/tank/iex/h5"
+COPY_ROWS = 4 * 1024 * 1024
+
+
+def top_symbols(h5_file: tables.File, count: int) -> typing.List[str]:
+    # busiest by trade count, which is what backtests replay.
+    symbol_index = day_format.read_symbol_index(h5_file, "trade_report_message")
+    rows = symbol_index["stop"] - symbol_index["start"]
+    busiest = symbol_index["symbol"][np.argsort(-rows, kind="stable")[:count]]
+    return [symbol.decode().rstrip() for symbol in busiest]
+
+
+def build_day(h5_path: str, hot_root: str, symbol_count: int, symbols: typing.Optional[typing.List[str]] = None):
+    """
+    Copy the rows of the `symbol_count` busiest symbols (or of `symbols`) of a day file into the hot tier.
+    """
+    date = os.path.splitext(os.path.basename(h5_path))[0]
+    day_path = os.path.join(hot_root, date)
+    # built aside and renamed, so readers never see a half written day.
+    tmp_path = f"{day_path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+
+    with tables.open_file(h5_path, "r") as h5_file:
+        if symbols is None:
+            symbols = top_symbols(h5_file, symbol_count)
+        symbols = sorted(symbols, key=day_format.pad_symbol)
+
+        for table_name, file_dtype in day_format.TABLES.items():
+            table_path = os.path.join(tmp_path, table_name)
+            os.makedirs(table_path)
+            symbol_index = day_format.read_symbol_index(h5_file, table_name)
+
+            ranges = [(day_format.pad_symbol(symbol), *day_format.symbol_table(h5_file, table_name, symbol, symbol_index)) for symbol in symbols]
+            hot_index = []
+            row = 0
+            for symbol_bytes, _, start, stop in ranges:
+                hot_index.append((symbol_bytes, row, row + stop - start))
+                row += stop - start
+            np.save(os.path.join(table_path, "symbol_index.npy"), np.array(hot_index, dtype=day_format.symbol_index_dtype))
+
+            names = [name for name in file_dtype.names if name != "symbol"]
+            columns = {name: np.lib.format.open_memmap(os.path.join(table_path, f"{name}.npy"), mode="w+", dtype=file_dtype[name], shape=(row,)) for name in names}
+            for (_, table, start, stop), (_, hot_start, _) in zip(ranges, hot_index):
+                for chunk_start in range(start, stop, COPY_ROWS):
+                    data = table.read(chunk_start, min(chunk_start + COPY_ROWS, stop))
+                    offset = hot_start + chunk_start - start
+                    for name in names:
+                        columns[name][offset : offset + len(data)] = data[name]
+            for column in columns.values():
+                column.flush()
+            del columns
+
+    shutil.rmtree(day_path, ignore_errors=True)
+    os.replace(tmp_path, day_path)
+    logging.info(f"built {day_path} with {len(symbols)} symbols")
+
+
+def evict_day(hot_root: str, date: str):
+    shutil.rmtree(os.path.join(hot_root, date))
+    logging.info(f"evicted {date}")
+
+
+def list_days(hot_root: str) -> typing.List[str]:
+    if not os.path.isdir(hot_root):
+        return []
+    return sorted(name for name in os.listdir(hot_root) if not name.endswith(".tmp"))
+
+
+def sync(h5_root: str, hot_root: str, day_count: int, symbol_count: int):
+    """
+    Make the hot tier hold exactly the latest `day_count` days of `h5_root`.
+    """
+    h5_paths = sorted(glob.glob(os.path.join(h5_root, "*.h5")))[-day_count:]
+    wanted = {os.path.splitext(os.path.basename(h5_path))[0]: h5_path for h5_path in h5_paths}
+    for date in list_days(hot_root):
+        if date not in wanted:
+            evict_day(hot_root, date)
+    present = set(list_days(hot_root))
+    for date, h5_path in wanted.items():
+        if date not in present:
+            build_day(h5_path, hot_root, symbol_count)
+
+
+class HotDay:
+    """
+    Read-only view of one day of the hot tier. Columns are memory mapped, so slices of them are not copies
+    and every process reading the same day shares the page cache.
+    """
+
+    def __init__(self, date: str, hot_root: str = HOT_ROOT):
+        self.path = os.path.join(hot_root, date)
+        self.symbol_indexes = {}
+        self.columns = {}
+        for table_name in day_format.TABLES:
+            table_path = os.path.join(self.path, table_name)
+            self.symbol_indexes[table_name] = np.load(os.path.join(table_path, "symbol_index.npy"))
+            self.columns[table_name] = {os.path.splitext(filename)[0]: np.load(os.path.join(table_path, filename), mmap_mode="r") for filename in os.listdir(table_path) if filename != "symbol_index.npy"}
+
+    def symbols(self, table_name: str) -> typing.List[str]:
+        return [symbol.decode().rstrip() for symbol in self.symbol_indexes[table_name]["symbol"]]
+
+    def read_symbol(self, table_name: str, symbol: str, columns: typing.Optional[typing.List[str]] = None) -> typing.Dict[str, np.ndarray]:
+        start, stop = day_format.symbol_range(self.symbol_indexes[table_name], symbol)
+        names = columns or list(self.columns[table_name])
+        return {name: self.columns[table_name][name][start:stop] for name in names}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hot-root", type=str, default=HOT_ROOT)
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    sync_parser = subparsers.add_parser("sync", help="build the latest days and evict the older ones")
+    sync_parser.add_argument("--h5-root", type=str, default=H5_ROOT)
+    sync_parser.add_argument("--days", type=int, default=20)
+    sync_parser.add_argument("--symbols", type=int, default=500)
+    build_parser = subparsers.add_parser("build", help="build days from day files")
+    build_parser.add_argument("paths", type=str, nargs="+")
+    build_parser.add_argument("--symbols", type=int, default=500)
+    evict_parser = subparsers.add_parser("evict", help="remove days")
+    evict_parser.add_argument("dates", type=str, nargs="+")
+    subparsers.add_parser("list", help="list the days in the hot tier")
+    args = parser.parse_args()
+
+    if args.action == "sync":
+        sync(args.h5_root, args.hot_root, args.days, args.symbols)
+    elif args.action == "build":
+        for path in args.paths:
+            build_day(path, args.hot_root, args.symbols)
+    elif args.action == "evict":
+        for date in args.dates:
+            evict_day(args.hot_root, date)
+    else:
+        for date in list_days(args.hot_root):
+            print(date)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    main()
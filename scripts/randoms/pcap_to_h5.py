@@ -0,0 +1,147 @@
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import typing
+
+import numpy as np
+import tables
+
+import catalog
+import day_format
+import snapshots
+
+# The numba parser lives in schemas/, run `python generate_schemas.py --path yamls/structs` there first.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "schemas"))
+import hello  # noqa: E402
+
+H5_TABLES = {
+    "TradeReportMessage": "trade_report_message",
+    "QuoteUpdateMessage": "quote_update_message",
+}
+
+BATCH_BYTES = 512 * 1024 * 1024
+
+
+def sort_run(data: np.ndarray) -> typing.Tuple[np.ndarray, typing.Dict[bytes, typing.Tuple[int, int]]]:
+    """
+    Sort a batch by symbol, returns it with the [start, stop) rows of every symbol.
+
+    The batch is in stream order, so a stable sort keeps the rows of every symbol in timestamp order.
+    """
+    data = data[np.argsort(data["symbol"], kind="stable")]
+    symbols, starts = np.unique(data["symbol"], return_index=True)
+    stops = np.append(starts[1:], len(data))
+    return data, {symbol_bytes: (int(start), int(stop)) for symbol_bytes, start, stop in zip(symbols.tolist(), starts, stops)}
+
+
+def flush(
+    runs: typing.Dict[str, typing.List[typing.Tuple[np.ndarray, typing.Dict[bytes, typing.Tuple[int, int]]]]],
+    batches: typing.Dict[str, typing.List[np.ndarray]],
+    spill_path: typing.Optional[str],
+):
+    """
+    Turn the batches into one sorted run per table. With `spill_path` the runs are written there as raw .npy and
+    memory mapped back, otherwise they stay in memory.
+    """
+    for message_name, table_name in H5_TABLES.items():
+        if not batches[message_name]:
+            continue
+        # the generated message dtypes share their byte layout with the archive dtypes.
+        data, symbol_rows = sort_run(np.concatenate(batches[message_name]).view(day_format.TABLES[table_name]))
+        batches[message_name].clear()
+        if spill_path is not None:
+            run_path = os.path.join(spill_path, f"{table_name}-{len(runs[table_name])}.npy")
+            np.save(run_path, data)
+            data = np.load(run_path, mmap_mode="r")
+        runs[table_name].append((data, symbol_rows))
+
+
+def run(
+    input_path: str,
+    output_path: str,
+    compression_level: int,
+    compression_library: str,
+    batch_bytes: int,
+    shard_count: int,
+    snapshot_interval: int = snapshots.SNAPSHOT_INTERVAL,
+):
+    for message_name, table_name in H5_TABLES.items():
+        assert hello.message_dtypes[hello.message_names.index(message_name)].itemsize == day_format.TABLES[table_name].itemsize
+
+    filters = tables.Filters(
+        complevel=compression_level,
+        complib=compression_library,
+        shuffle=True,
+    )
+    # every batch is sorted by symbol into a run, and the runs are merged symbol by symbol into the day tables.
+    # A day that fits in one batch never touches the disk, larger ones spill their runs next to the output.
+    runs = {table_name: [] for table_name in H5_TABLES.values()}
+    batches = {message_name: [] for message_name in H5_TABLES}
+    batch_size = 0
+    spill_path = tempfile.mkdtemp(prefix=f"{os.path.basename(output_path)}.", suffix=".runs", dir=os.path.dirname(os.path.abspath(output_path)))
+
+    try:
+        with tables.open_file(output_path, "w") as h5_file:
+            # quotes come out in stream order, which is what the snapshots are cut from.
+            snapshot_writer = snapshots.SnapshotWriter(h5_file, filters, snapshot_interval) if snapshot_interval else None
+            for messages in hello.iter_decoded_chunks(input_path, shard_count):
+                if snapshot_writer is not None:
+                    snapshot_writer.append(messages["QuoteUpdateMessage"].view(day_format.TABLES["quote_update_message"]))
+                for message_name in H5_TABLES:
+                    batches[message_name].append(messages[message_name])
+                    batch_size += messages[message_name].nbytes
+
+                if batch_size >= batch_bytes:
+                    logging.info(f"spilling a run of {batch_size} bytes")
+                    flush(runs, batches, spill_path)
+                    batch_size = 0
+
+            flush(runs, batches, None)
+            if snapshot_writer is not None:
+                snapshot_writer.close()
+
+            for table_name, table_runs in runs.items():
+                symbols = sorted(set().union(*[symbol_rows.keys() for _, symbol_rows in table_runs]), key=lambda symbol_bytes: symbol_bytes.ljust(8))
+                writer = day_format.DayWriter(h5_file, table_name, filters, sum(len(data) for data, _ in table_runs))
+                chunk_rows = max(batch_bytes // day_format.TABLES[table_name].itemsize, 1)
+                for symbol_bytes in symbols:
+                    # the runs are in stream order, so chaining a symbol's rows across them keeps timestamp order.
+                    for data, symbol_rows in table_runs:
+                        start, stop = symbol_rows.get(symbol_bytes, (0, 0))
+                        for chunk_start in range(start, stop, chunk_rows):
+                            writer.append(symbol_bytes.ljust(8), np.asarray(data[chunk_start : min(chunk_start + chunk_rows, stop)]))
+                writer.close()
+    finally:
+        shutil.rmtree(spill_path, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", type=str, required=True)
+    parser.add_argument("-o", type=str, required=True)
+    parser.add_argument("--batch-mb", type=int, default=BATCH_BYTES // (1024 * 1024))
+    parser.add_argument("--shards", type=int, default=os.cpu_count())
+    parser.add_argument("--snapshot-ms", type=int, default=snapshots.SNAPSHOT_INTERVAL // 1_000_000, help="quote snapshot interval, 0 disables them")
+    parser.add_argument("--catalog", type=str, default=None, help="record the output in this catalog database")
+    args = parser.parse_args()
+
+    run(
+        args.i,
+        args.o,
+        5,
+        "blosc:zstd",
+        args.batch_mb * 1024 * 1024,
+        args.shards,
+        args.snapshot_ms * 1_000_000,
+    )
+
+    if args.catalog is not None:
+        catalog.Catalog(args.catalog).record_file(args.o)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    main()
@@ -1,45 +1,57 @@
-import datetime
-
 import numpy as np
 import tables
 import plotly.graph_objs as go
 
+import day_format
+
 # Define the path to your HDF5 file
 hdf5_file_path = "/home/hbina/Downloads/20240226.h5"
+# Only the trades of this window are read
+t0 = np.datetime64("2024-02-26T14:30", "ns").astype(np.int64)
+t1 = np.datetime64("2024-02-26T14:40", "ns").astype(np.int64)
+# A chart is about 2000 pixels wide, more points than that per trace are not visible anyway
+max_points_per_trace = 2000
+
+
+def downsample_min_max(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Indices of the lowest and highest point of every x bucket, with about `max_points / 2` equal-width buckets.
+
+    The envelope of the line is kept, so spikes survive the downsampling.
+    """
+    if len(x) <= max_points:
+        return np.arange(len(x))
+    bucket_count = max((max_points - 2) // 2, 1)
+    span = int(x[-1]) - int(x[0]) + 1
+    buckets = ((x - x[0]).astype(np.float64) * bucket_count / span).astype(np.int64)
+
+    # sorted by bucket then by y, the first row of a bucket is its minimum and the last its maximum.
+    order = np.lexsort((y, buckets))
+    starts = np.flatnonzero(np.diff(buckets[order], prepend=-1))
+    stops = np.append(starts[1:], len(order))
+    return np.unique(np.concatenate([order[starts], order[stops - 1], [0, len(x) - 1]]))
+
 
 # Open the HDF5 file in read mode
 fig = go.Figure()
 
 with tables.open_file(hdf5_file_path, mode="r") as file:
-    # Iterate through the groups in the HDF5 file
-    all_symbols = []
-    for symbols in file.walk_nodes(where="/"):
-        for symbol in symbols:
-            # print(symbol)
-            if not isinstance(symbol, tables.Group):
-                continue
-            symbol_str = symbol._v_name
-            all_symbols.append(symbol_str)
-
-    for symbol in all_symbols:
-        try:
-            trade_node = file.get_node(where=f"/{symbol}/trade_report_message.bin")
-        except:
+    for symbol in day_format.list_symbols(file, "trade_report_message"):
+        trade_data = day_format.read_symbol_time_range(file, "trade_report_message", symbol, t0, t1)
+        if len(trade_data) == 0:
             continue
 
-        trade_data = trade_node.read()
-
-        trade_ts = trade_data["timestamp"]
-        trade_ts = np.array([datetime.datetime.utcfromtimestamp(ts / 1_000_000_000) for ts in trade_ts])
-        trade_price = trade_data["price"] / 10000
+        keep = downsample_min_max(trade_data["timestamp"], trade_data["price"], max_points_per_trace)
+        trade_ts = trade_data["timestamp"][keep].astype("datetime64[ns]")
+        trade_price = trade_data["price"][keep] / 10000
 
-        trade_trace = go.Scatter(x=trade_ts, y=trade_price, mode="lines", name=symbol)
+        # WebGL traces stay responsive with thousands of symbols.
+        trade_trace = go.Scattergl(x=trade_ts, y=trade_price, mode="lines", name=symbol)
         fig.add_trace(trade_trace)
 
         # quote_node = file.get_node(where='/AAPL/quote_update_message.bin')
         # quote_data = quote_node.read()
-        # quote_ts = quote_data["timestamp"]
-        # quote_ts = np.array([datetime.datetime.utcfromtimestamp(ts / 1_000_000_000) for ts in quote_ts])
+        # quote_ts = quote_data["timestamp"].astype("datetime64[ns]")
         # quote_bid_price = quote_data["bid_price"] / 10000
         # quote_ask_price = quote_data["ask_price"] / 10000
 
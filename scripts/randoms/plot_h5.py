@@ -1,41 +1,25 @@
+import numpy as np
 import tables
 import plotly.graph_objs as go
 
+import day_format
+
 # Define the path to your HDF5 file
 hdf5_file_path = "/home/hbina/Downloads/2024026.h5"
+t0 = np.datetime64("2024-02-26T14:30", "ns").astype(np.int64)
+t1 = np.datetime64("2024-02-26T14:40", "ns").astype(np.int64)
 
 # Open the HDF5 file in read mode
 with tables.open_file(hdf5_file_path, mode="r") as file:
-    # Iterate through the groups in the HDF5 file
-    for symbols in file.walk_nodes(where="/"):
-        for symbol in symbols:
-            # print(symbol)
-            symbol_str = symbol._v_name
-
-            if symbol_str != "AAPL":
-                continue
-
-            for table in symbol:
-                # print(table)
-                table_str = table._v_name
-
-                data = table.read()
-                print(data)
-                # print(f"Group: {group._v_pathname}")
+    for table_str in day_format.TABLES:
+        data = day_format.read_symbol_time_range(file, table_str, "AAPL", t0, t1)
+        print(data)
+        # print(f"Group: {group._v_pathname}")
 
-                # trace = go.Scatter(x=x, y=y, mode='lines', name='Sine Wave')
-                # layout = go.Layout(title='Sine Wave', xaxis=dict(title='x'), yaxis=dict(title='y'))
-                # fig = go.Figure(data=[trace], layout=layout)
-                # fig.show()
-        #
-        # # Iterate through the tables (or nodes) within each group
-        # for node in file.walk_nodes(group, classname='Table'):
-        #     print(f"  Table: {node._v_pathname}")
-        #     print(f"  Number of rows: {node.nrows}")
-        #
-        #     # Optionally, print the first row as an example
-        #     if node.nrows > 0:
-        #         print(f"  First row: {node[0]}")
+        # trace = go.Scatter(x=x, y=y, mode='lines', name='Sine Wave')
+        # layout = go.Layout(title='Sine Wave', xaxis=dict(title='x'), yaxis=dict(title='y'))
+        # fig = go.Figure(data=[trace], layout=layout)
+        # fig.show()
 
     # You can also iterate over all nodes if you don't want to limit to tables
     print("\nIterating through all nodes:")
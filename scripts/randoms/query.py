@@ -0,0 +1,47 @@
+import argparse
+import os
+
+import numpy as np
+import tables
+
+import day_format
+
+H5_ROOT = "/tank/iex/h5"
+
+
+def day_path(date: str, h5_root: str = H5_ROOT) -> str:
+    return os.path.join(h5_root, f"{date}.h5")
+
+
+def to_nanoseconds(value) -> int:
+    # accepts nanoseconds since the epoch or anything np.datetime64 parses, e.g. "2024-02-26T14:30".
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return int(np.datetime64(value, "ns").astype(np.int64))
+
+
+def read_window(date: str, symbol: str, table_name: str, t0, t1, h5_root: str = H5_ROOT) -> np.ndarray:
+    """
+    Rows of one symbol and message table of a day with `t0 <= timestamp < t1`.
+    """
+    with tables.open_file(day_path(date, h5_root), "r") as h5_file:
+        return day_format.read_symbol_time_range(h5_file, table_name, symbol, to_nanoseconds(t0), to_nanoseconds(t1))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("date", type=str, help="YYYYMMDD")
+    parser.add_argument("symbol", type=str)
+    parser.add_argument("t0", type=str, help="UTC, e.g. 2024-02-26T14:30")
+    parser.add_argument("t1", type=str)
+    parser.add_argument("--table", type=str, default="trade_report_message", choices=list(day_format.TABLES))
+    parser.add_argument("--h5-root", type=str, default=H5_ROOT)
+    args = parser.parse_args()
+
+    data = read_window(args.date, args.symbol, args.table, args.t0, args.t1, args.h5_root)
+    print(f"{len(data)} rows")
+    print(data)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import typing
+
+import numpy as np
+import tables
+
+import day_format
+from dtypes import quote_update_message_dtype
+
+# Top of book of every symbol at fixed times, written next to the day tables:
+#   /quote_snapshots/state    for every snapshot, the last quote of every symbol quoted so far, sorted by symbol,
+#                             with `row`, the number of quotes of the symbol up to the snapshot
+#   /quote_snapshots/offsets  snapshot k is rows offsets[k]..offsets[k + 1] of the state table
+#   /quote_snapshots/times    snapshot k holds the quotes with timestamp <= times[k]
+SNAPSHOT_INTERVAL = 1_000_000_000
+
+snapshot_dtype = np.dtype(quote_update_message_dtype.descr + [("row", "<i8")])
+
+
+class SnapshotWriter:
+    """
+    Build quote snapshots from the quotes of a day in stream order, as they are decoded.
+    """
+
+    def __init__(self, h5_file: tables.File, filters: tables.Filters, interval: int = SNAPSHOT_INTERVAL):
+        self.h5_file = h5_file
+        self.interval = interval
+        self.table = h5_file.create_table(
+            where="/quote_snapshots",
+            name="state",
+            description=snapshot_dtype,
+            filters=filters,
+            createparents=True,
+        )
+        self.times = []
+        self.offsets = [0]
+        self.next_time = None
+        self.symbol_ids = {}
+        self.state = np.zeros(0, dtype=snapshot_dtype)
+
+    def append(self, quotes: np.ndarray):
+        if len(quotes) == 0:
+            return
+        timestamps = quotes["timestamp"]
+        if self.next_time is None:
+            self.next_time = (int(timestamps[0]) // self.interval + 1) * self.interval
+
+        start = 0
+        while self.next_time <= timestamps[-1]:
+            stop = start + int(np.searchsorted(timestamps[start:], np.uint64(self.next_time), side="right"))
+            self.update(quotes[start:stop])
+            self.snapshot()
+            start = stop
+        self.update(quotes[start:])
+
+    def update(self, quotes: np.ndarray):
+        if len(quotes) == 0:
+            return
+        symbols, counts = np.unique(quotes["symbol"], return_counts=True)
+        new_symbols = [symbol for symbol in symbols if symbol not in self.symbol_ids]
+        if new_symbols:
+            for symbol in new_symbols:
+                self.symbol_ids[symbol] = len(self.symbol_ids)
+            self.state = np.concatenate([self.state, np.zeros(len(new_symbols), dtype=snapshot_dtype)])
+
+        ids = np.array([self.symbol_ids[symbol] for symbol in symbols], dtype=np.int64)
+        # np.unique on the reversed quotes finds the last quote of every symbol.
+        _, last = np.unique(quotes["symbol"][::-1], return_index=True)
+        last = len(quotes) - 1 - last
+        rows = self.state["row"][ids] + counts
+        for name in quote_update_message_dtype.names:
+            self.state[name][ids] = quotes[name][last]
+        self.state["row"][ids] = rows
+
+    def snapshot(self):
+        self.table.append(np.sort(self.state, order="symbol"))
+        self.times.append(self.next_time)
+        self.offsets.append(self.table.nrows)
+        self.next_time += self.interval
+
+    def close(self):
+        if self.next_time is not None:
+            self.snapshot()
+        self.table.flush()
+        self.h5_file.create_array("/quote_snapshots", "times", obj=np.array(self.times, dtype=np.uint64))
+        self.h5_file.create_array("/quote_snapshots", "offsets", obj=np.array(self.offsets, dtype=np.int64))
+
+
+def read_snapshot(h5_file: tables.File, k: int) -> np.ndarray:
+    offsets = h5_file.get_node("/quote_snapshots/offsets")
+    if k < 0 or k >= len(offsets) - 1:
+        return np.zeros(0, dtype=snapshot_dtype)
+    start, stop = offsets[k : k + 2]
+    return h5_file.get_node("/quote_snapshots/state").read(start, stop)
+
+
+def snapshot_before(h5_file: tables.File, timestamp: int) -> int:
+    times = h5_file.get_node("/quote_snapshots/times").read()
+    return int(np.searchsorted(times, np.uint64(timestamp), side="right")) - 1
+
+
+def find_symbol(snapshot: np.ndarray, symbol_bytes: bytes) -> typing.Optional[np.ndarray]:
+    i = np.searchsorted(snapshot["symbol"], symbol_bytes)
+    if i == len(snapshot) or snapshot["symbol"][i] != symbol_bytes:
+        return None
+    return snapshot[i]
+
+
+def scan_quote(table: tables.Table, chunk_timestamps, symbol_start: int, symbol_stop: int, row: int, timestamp: int) -> typing.Optional[np.ndarray]:
+    """
+    Last quote of a symbol with a timestamp <= `timestamp`, looking only at the rows from `row` on.
+    """
+    stop = day_format.timestamp_row(table, chunk_timestamps, symbol_start + row, symbol_stop, int(timestamp) + 1)
+    if stop == symbol_start + row:
+        return None
+    return table.read(stop - 1, stop)[0]
+
+
+def to_quotes(state: np.ndarray) -> np.ndarray:
+    quotes = np.empty(len(state), dtype=quote_update_message_dtype)
+    for name in quote_update_message_dtype.names:
+        quotes[name] = state[name]
+    return quotes
+
+
+def quote_at(h5_file: tables.File, symbol: str, timestamp: int) -> typing.Optional[np.ndarray]:
+    """
+    The quote of `symbol` in force at `timestamp`, None if it had not been quoted yet.
+    """
+    table = h5_file.get_node("/quote_update_message")
+    chunk_timestamps = day_format.read_chunk_timestamps(h5_file, "quote_update_message")
+    symbol_start, symbol_stop = day_format.symbol_range(day_format.read_symbol_index(h5_file, "quote_update_message"), symbol)
+    state = find_symbol(read_snapshot(h5_file, snapshot_before(h5_file, timestamp)), day_format.pad_symbol(symbol))
+    row = 0 if state is None else int(state["row"])
+
+    quote = scan_quote(table, chunk_timestamps, symbol_start, symbol_stop, row, timestamp)
+    if quote is None and state is not None:
+        quote = to_quotes(state[np.newaxis])[0]
+    return quote
+
+
+def quotes_at(h5_file: tables.File, timestamp: int) -> np.ndarray:
+    """
+    The quote in force at `timestamp` of every symbol quoted by then, sorted by symbol.
+
+    Only the symbols whose quote count differs in the following snapshot are scanned.
+    """
+    table = h5_file.get_node("/quote_update_message")
+    chunk_timestamps = day_format.read_chunk_timestamps(h5_file, "quote_update_message")
+    symbol_index = day_format.read_symbol_index(h5_file, "quote_update_message")
+    k = snapshot_before(h5_file, timestamp)
+    state = read_snapshot(h5_file, k)
+    following = read_snapshot(h5_file, k + 1)
+
+    quotes = dict(zip(state["symbol"].tolist(), to_quotes(state)))
+    rows = dict(zip(state["symbol"].tolist(), state["row"].tolist()))
+    for symbol_bytes, next_row in zip(following["symbol"].tolist(), following["row"].tolist()):
+        row = rows.get(symbol_bytes, 0)
+        if next_row == row:
+            continue
+        symbol_start, symbol_stop = day_format.symbol_range(symbol_index, symbol_bytes.decode().rstrip())
+        quote = scan_quote(table, chunk_timestamps, symbol_start, symbol_stop, row, timestamp)
+        if quote is not None:
+            quotes[symbol_bytes] = quote
+
+    return np.array([quotes[symbol_bytes] for symbol_bytes in sorted(quotes)], dtype=quote_update_message_dtype)
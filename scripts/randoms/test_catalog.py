@@ -0,0 +1,59 @@
+import warnings
+
+import numpy as np
+import pytest
+import tables
+
+import catalog
+import day_format
+from dtypes import trade_report_message_dtype
+
+
+def make_trades(symbol: str, timestamps) -> np.ndarray:
+    data = np.zeros(len(timestamps), dtype=trade_report_message_dtype)
+    data["symbol"] = day_format.pad_symbol(symbol)
+    data["timestamp"] = timestamps
+    return data
+
+
+TRADES = {
+    "SPY": make_trades("SPY", [100, 200, 300]),
+    "A": make_trades("A", [150, 250]),
+}
+
+
+def write_legacy_file(path: str):
+    with tables.open_file(path, "w") as h5_file, warnings.catch_warnings():
+        # the old tables are named after the raw files, which are not Python identifiers.
+        warnings.simplefilter("ignore", tables.NaturalNameWarning)
+        for symbol, data in TRADES.items():
+            h5_file.create_table(where=f"/{symbol}", name="trade_report_message.bin", createparents=True, obj=data)
+
+
+def write_day_file(path: str):
+    with tables.open_file(path, "w") as h5_file:
+        writer = day_format.DayWriter(h5_file, "trade_report_message", tables.Filters(complevel=1))
+        for symbol in sorted(TRADES, key=day_format.pad_symbol):
+            writer.append(day_format.pad_symbol(symbol), TRADES[symbol])
+        writer.close()
+
+
+@pytest.mark.parametrize("write_file", [write_legacy_file, write_day_file])
+def test_record_file(tmp_path, write_file):
+    h5_path = str(tmp_path / "20240102.h5")
+    write_file(h5_path)
+    manifest = catalog.Catalog(str(tmp_path / "catalog.db"))
+    manifest.record_file(h5_path)
+
+    rows = manifest.find(table_name="trade_report_message")
+    assert [(row.symbol, row.rows, row.min_timestamp, row.max_timestamp) for row in rows] == [("A", 2, 150, 250), ("SPY", 3, 100, 300)]
+    assert manifest.find_paths(symbol="SPY", t0=250, t1=400) == [h5_path]
+    assert manifest.find_paths(symbol="A", t0=251) == []
+
+
+def test_record_file_without_day_tables(tmp_path):
+    h5_path = str(tmp_path / "20240102.h5")
+    with tables.open_file(h5_path, "w") as h5_file:
+        h5_file.create_group("/", "unrelated")
+    with pytest.raises(ValueError):
+        catalog.Catalog(str(tmp_path / "catalog.db")).record_file(h5_path)
@@ -0,0 +1,72 @@
+import warnings
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+import tables
+
+import day_format
+import export_parquet
+from dtypes import trade_report_message_dtype
+
+SYMBOLS = ["A", "QQQ", "SPY", "ZZ"]
+
+
+def make_trades() -> np.ndarray:
+    rng = np.random.default_rng(0)
+    data = np.zeros(1000, dtype=trade_report_message_dtype)
+    data["symbol"] = [day_format.pad_symbol(symbol) for symbol in rng.choice(SYMBOLS, len(data))]
+    data["timestamp"] = 1_704_205_800_000_000_000 + np.arange(len(data)) * 1000
+    data["price"] = rng.integers(1, 1_000_000, len(data))
+    data["trade_id"] = np.arange(len(data))
+    return data
+
+
+def write_legacy_file(path: str, data: np.ndarray):
+    with tables.open_file(path, "w") as h5_file, warnings.catch_warnings():
+        warnings.simplefilter("ignore", tables.NaturalNameWarning)
+        for symbol in SYMBOLS:
+            rows = data[data["symbol"] == day_format.pad_symbol(symbol)]
+            h5_file.create_table(where=f"/{symbol}", name="trade_report_message.bin", createparents=True, obj=rows)
+
+
+def write_day_file(path: str, data: np.ndarray):
+    with tables.open_file(path, "w") as h5_file:
+        writer = day_format.DayWriter(h5_file, "trade_report_message", tables.Filters(complevel=1), chunkshape=64)
+        for symbol in SYMBOLS:
+            writer.append(day_format.pad_symbol(symbol), data[data["symbol"] == day_format.pad_symbol(symbol)])
+        writer.close()
+
+
+@pytest.mark.parametrize("write_file", [write_legacy_file, write_day_file])
+def test_export_table_round_trip(tmp_path, write_file):
+    data = make_trades()
+    h5_path = str(tmp_path / "20240102.h5")
+    write_file(h5_path, data)
+    output_path = str(tmp_path / "trades.parquet")
+    export_parquet.export_table(h5_path, "trade_report_message", output_path, row_group_rows=300)
+
+    expected = day_format.sort_rows(data)
+    table = pq.read_table(output_path)
+    assert table.column("symbol").type == pa.dictionary(pa.int32(), pa.string())
+    assert table.column("symbol").combine_chunks().dictionary.to_pylist() == SYMBOLS
+    assert table.column("symbol").to_pylist() == [symbol.decode().rstrip() for symbol in expected["symbol"]]
+    assert table.column("timestamp").type == pa.timestamp("ns", tz="UTC")
+    assert np.array_equal(table.column("timestamp").cast(pa.int64()).to_numpy(), expected["timestamp"].astype(np.int64))
+    for name in ("price", "trade_id", "size"):
+        assert np.array_equal(table.column(name).to_numpy(), expected[name])
+
+    metadata = pq.ParquetFile(output_path).metadata
+    assert [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)] == [300, 300, 300, 100]
+    names = metadata.schema.names
+    start = 0
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        rows = expected[start : start + row_group.num_rows]
+        start += row_group.num_rows
+        symbol_statistics = row_group.column(names.index("symbol")).statistics
+        assert (symbol_statistics.min, symbol_statistics.max) == (rows["symbol"][0].decode().rstrip(), rows["symbol"][-1].decode().rstrip())
+        timestamp_statistics = row_group.column(names.index("timestamp")).statistics
+        assert timestamp_statistics.has_min_max
+        assert (timestamp_statistics.min_raw, timestamp_statistics.max_raw) == (rows["timestamp"].min(), rows["timestamp"].max())
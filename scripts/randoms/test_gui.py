@@ -0,0 +1,128 @@
+import os
+import warnings
+
+# set before Qt loads its platform plugin, so the test runs without a display.
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+import pytest
+import tables
+from PySide6 import QtWidgets
+
+import day_format
+import gui
+from dtypes import trade_report_message_dtype
+
+SYMBOL_ROWS = {"A": 300, "SPY": 700}
+
+
+def make_trades(symbol: str, count: int) -> np.ndarray:
+    data = np.zeros(count, dtype=trade_report_message_dtype)
+    data["symbol"] = day_format.pad_symbol(symbol)
+    data["timestamp"] = 1_000 + np.arange(count)
+    data["price"] = np.arange(count) * 10
+    data["trade_id"] = np.arange(count)
+    return data
+
+
+def write_day_file(path: str):
+    with tables.open_file(path, "w") as h5_file:
+        writer = day_format.DayWriter(h5_file, "trade_report_message", tables.Filters(complevel=1))
+        for symbol in sorted(SYMBOL_ROWS, key=day_format.pad_symbol):
+            writer.append(day_format.pad_symbol(symbol), make_trades(symbol, SYMBOL_ROWS[symbol]))
+        writer.close()
+
+
+def write_legacy_file(path: str):
+    with tables.open_file(path, "w") as h5_file, warnings.catch_warnings():
+        # the old tables are named after the raw files, which are not Python identifiers.
+        warnings.simplefilter("ignore", tables.NaturalNameWarning)
+        for symbol, count in SYMBOL_ROWS.items():
+            h5_file.create_table(where=f"/{symbol}", name="trade_report_message.bin", createparents=True, obj=make_trades(symbol, count))
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+def model_rows(model: gui.H5TableModel) -> list:
+    return [[model.data(model.index(row, column)) for column in range(model.columnCount())] for row in range(model.rowCount())]
+
+
+def expected_rows(data: np.ndarray) -> list:
+    rows = []
+    for row in data:
+        values = {name: str(row[name]) for name in data.dtype.names}
+        values["timestamp"] = str(np.datetime64(int(row["timestamp"]), "ns"))
+        values["symbol"] = row["symbol"].decode().rstrip()
+        rows.append([values[name] for name in data.dtype.names])
+    return rows
+
+
+def test_table_model(app, tmp_path):
+    h5_path = str(tmp_path / "20240102.h5")
+    write_day_file(h5_path)
+    with tables.open_file(h5_path, "r") as h5_file:
+        table = h5_file.get_node("/trade_report_message")
+        start, stop = day_format.symbol_range(day_format.read_symbol_index(h5_file, "trade_report_message"), "SPY")
+        model = gui.H5TableModel(table, start, stop, gui.ChunkCache(chunk_rows=64))
+        assert model.rowCount() == stop - start == SYMBOL_ROWS["SPY"]
+        assert model.columnCount() == len(table.dtype.names)
+        assert model_rows(model) == expected_rows(table.read(start, stop))
+
+
+def test_chunk_cache_evicts_least_recently_used(tmp_path):
+    h5_path = str(tmp_path / "20240102.h5")
+    write_day_file(h5_path)
+    with tables.open_file(h5_path, "r") as h5_file:
+        table = h5_file.get_node("/trade_report_message")
+        cache = gui.ChunkCache(max_chunks=32, chunk_rows=8)
+        for row in range(0, 33 * 8, 8):
+            assert cache.row(table, row) == table.read(row, row + 1)[0]
+        assert len(cache.chunks) == 32
+        assert (table._v_pathname, 0) not in cache.chunks
+
+        # a hit makes a chunk the most recently used, so the next miss evicts the one after it.
+        cache.row(table, 8)
+        cache.row(table, 40 * 8)
+        assert (table._v_pathname, 1) in cache.chunks
+        assert (table._v_pathname, 2) not in cache.chunks
+        assert len(cache.chunks) == 32
+
+
+@pytest.mark.parametrize("write_file", [write_day_file, write_legacy_file])
+def test_open_path(app, tmp_path, write_file):
+    h5_path = str(tmp_path / "20240102.h5")
+    write_file(h5_path)
+    widget = gui.MyWidget()
+    try:
+        widget.open_path(h5_path)
+        assert [widget.table_names.itemText(i) for i in range(widget.table_names.count())] == ["trade_report_message"]
+        assert [widget.symbols.item(i).text() for i in range(widget.symbols.count())] == [gui.ALL_SYMBOLS, "A", "SPY"]
+
+        widget.symbols.setCurrentRow(2)
+        assert model_rows(widget.rows.model()) == expected_rows(make_trades("SPY", SYMBOL_ROWS["SPY"]))
+        assert widget.text.text() == h5_path
+
+        widget.symbols.setCurrentRow(0)
+        if write_file is write_legacy_file:
+            assert widget.rows.model() is None
+            assert "legacy" in widget.text.text()
+        else:
+            assert widget.rows.model().rowCount() == sum(SYMBOL_ROWS.values())
+    finally:
+        widget.close_file()
+
+
+def test_open_path_without_day_tables(app, tmp_path):
+    h5_path = str(tmp_path / "20240102.h5")
+    with tables.open_file(h5_path, "w") as h5_file:
+        h5_file.create_group("/", "unrelated")
+    widget = gui.MyWidget()
+    try:
+        widget.open_path(h5_path)
+        assert widget.table_names.count() == 0
+        assert widget.text.text() != h5_path
+    finally:
+        widget.close_file()
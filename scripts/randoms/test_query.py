@@ -0,0 +1,55 @@
+import warnings
+
+import numpy as np
+import pytest
+import tables
+
+import day_format
+import query
+from dtypes import trade_report_message_dtype
+
+CHUNK_ROWS = 4
+
+
+def make_trades(symbol: str, timestamps) -> np.ndarray:
+    data = np.zeros(len(timestamps), dtype=trade_report_message_dtype)
+    data["symbol"] = day_format.pad_symbol(symbol)
+    data["timestamp"] = timestamps
+    data["trade_id"] = np.arange(len(timestamps))
+    return data
+
+
+# several chunks per symbol, with timestamps repeated across chunk boundaries.
+TRADES = {
+    "SPY": make_trades("SPY", [100, 110, 120, 130, 130, 130, 130, 140, 150, 160, 170, 180, 190]),
+    "A": make_trades("A", [105, 115, 125, 135, 145, 155]),
+}
+
+
+def write_legacy_file(path: str):
+    with tables.open_file(path, "w") as h5_file, warnings.catch_warnings():
+        # the old tables are named after the raw files, which are not Python identifiers.
+        warnings.simplefilter("ignore", tables.NaturalNameWarning)
+        for symbol, data in TRADES.items():
+            h5_file.create_table(where=f"/{symbol}", name="trade_report_message.bin", createparents=True, obj=data, chunkshape=(CHUNK_ROWS,))
+
+
+def write_day_file(path: str):
+    with tables.open_file(path, "w") as h5_file:
+        writer = day_format.DayWriter(h5_file, "trade_report_message", tables.Filters(complevel=1), chunkshape=CHUNK_ROWS)
+        for symbol in sorted(TRADES, key=day_format.pad_symbol):
+            writer.append(day_format.pad_symbol(symbol), TRADES[symbol])
+        writer.close()
+
+
+@pytest.mark.parametrize("write_file", [write_legacy_file, write_day_file])
+def test_read_window(tmp_path, write_file):
+    write_file(query.day_path("20240102", str(tmp_path)))
+
+    for symbol, data in TRADES.items():
+        for t0 in range(95, 200, 5):
+            for t1 in range(t0, 200, 5):
+                window = query.read_window("20240102", symbol, "trade_report_message", t0, t1, str(tmp_path))
+                expected = data[(t0 <= data["timestamp"]) & (data["timestamp"] < t1)]
+                assert np.array_equal(window, expected), (symbol, t0, t1)
+    assert len(query.read_window("20240102", "QQQ", "trade_report_message", 0, 1000, str(tmp_path))) == 0
@@ -0,0 +1,106 @@
+import argparse
+import logging
+import typing
+
+import numpy as np
+import tables
+
+import day_format
+from dtypes import trade_report_message_dtype, quote_update_message_dtype
+
+CHUNK_ROWS = 1_000_000
+
+# a trade and the quote in force when it printed, all zeros when the symbol had no quote yet.
+trade_quote_dtype = np.dtype(
+    trade_report_message_dtype.descr
+    + [
+        ("quote_timestamp", "<u8"),
+        ("bid_size", "<u4"),
+        ("bid_price", "<u8"),
+        ("ask_price", "<u8"),
+        ("ask_size", "<u4"),
+        ("spread", "<i8"),
+    ]
+)
+
+QUOTE_COLUMNS = ("bid_size", "bid_price", "ask_price", "ask_size")
+
+
+def join_chunk(trades: np.ndarray, quote_pieces: typing.Iterable[np.ndarray], prevailing: typing.Optional[np.ndarray]) -> typing.Tuple[np.ndarray, typing.Optional[np.ndarray]]:
+    """
+    As-of join of a chunk of trades to the quotes that may be in force during it.
+
+    `quote_pieces` are the quotes following the ones already seen, up to the last trade of the chunk, and
+    `prevailing` the last quote seen before them. A quote with the same timestamp as a trade is in force
+    for it. Returns the joined trades and the quote prevailing at the end of the chunk.
+    """
+    trade_timestamps = trades["timestamp"]
+    quotes = np.zeros(len(trades), dtype=quote_update_message_dtype)
+    if prevailing is not None:
+        quotes[:] = prevailing
+
+    for piece in quote_pieces:
+        if len(piece) == 0:
+            continue
+        # trades before this piece keep the quote found in an earlier one.
+        lo = np.searchsorted(trade_timestamps, piece["timestamp"][0], side="left")
+        quotes[lo:] = piece[np.searchsorted(piece["timestamp"], trade_timestamps[lo:], side="right") - 1]
+        prevailing = piece[-1]
+
+    joined = np.empty(len(trades), dtype=trade_quote_dtype)
+    for name in trade_report_message_dtype.names:
+        joined[name] = trades[name]
+    joined["quote_timestamp"] = quotes["timestamp"]
+    for name in QUOTE_COLUMNS:
+        joined[name] = quotes[name]
+    two_sided = (quotes["bid_price"] > 0) & (quotes["ask_price"] > 0)
+    joined["spread"] = np.where(two_sided, quotes["ask_price"].astype(np.int64) - quotes["bid_price"].astype(np.int64), 0)
+    return joined, prevailing
+
+
+def iter_trades_with_quotes(h5_file: tables.File, symbol: str, chunk_rows: int = CHUNK_ROWS) -> typing.Iterator[np.ndarray]:
+    """
+    Trades of `symbol` with the prevailing bid and ask, `chunk_rows` trades at a time.
+
+    Trades and quotes are read in chunks of at most `chunk_rows` rows, so a day is never loaded whole.
+    """
+    trade_table, trade_start, trade_stop = day_format.symbol_table(h5_file, "trade_report_message", symbol)
+    quote_table, quote_start, quote_stop = day_format.symbol_table(h5_file, "quote_update_message", symbol)
+    # a symbol without quotes has an empty quote range, which is never searched.
+    quote_chunk_timestamps = None if quote_table is None else day_format.read_chunk_timestamps(h5_file, "quote_update_message", quote_table)
+
+    prevailing = None
+    quote_row = quote_start
+    for start in range(trade_start, trade_stop, chunk_rows):
+        trades = trade_table.read(start, min(start + chunk_rows, trade_stop))
+        # quotes up to and including the last trade's timestamp.
+        quote_end = day_format.timestamp_row(quote_table, quote_chunk_timestamps, quote_row, quote_stop, int(trades["timestamp"][-1]) + 1)
+        quote_pieces = (quote_table.read(row, min(row + chunk_rows, quote_end)) for row in range(quote_row, quote_end, chunk_rows))
+        joined, prevailing = join_chunk(trades, quote_pieces, prevailing)
+        quote_row = quote_end
+        yield joined
+
+
+def trades_with_quotes(h5_file: tables.File, symbol: str, chunk_rows: int = CHUNK_ROWS) -> np.ndarray:
+    return np.concatenate([np.empty(0, dtype=trade_quote_dtype)] + list(iter_trades_with_quotes(h5_file, symbol, chunk_rows)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", type=str, required=True, help="day file")
+    parser.add_argument("-o", type=str, required=True, help="write the joined trades of all symbols to this .npy")
+    parser.add_argument("--symbols", type=str, nargs="+", default=None)
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    with tables.open_file(args.i, "r") as h5_file, open(args.o, "wb") as f:
+        symbols = args.symbols or day_format.list_symbols(h5_file, "trade_report_message")
+        joined = [trades_with_quotes(h5_file, symbol, args.chunk_rows) for symbol in symbols]
+        joined = np.concatenate([np.empty(0, dtype=trade_quote_dtype)] + joined)
+        logging.info(f"{len(joined)} trades joined for {len(symbols)} symbols")
+        np.save(f, joined)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    main()
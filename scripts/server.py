@@ -1,7 +1,10 @@
-from flask import Flask, render_template
+from flask import Flask, Response, abort, render_template, request
 import sqlite3
 
-from cron_db import CronDb
+from cron_db import LOG_CHUNK_BYTES, LOG_STREAMS, CronDb
+
+# the log page shows the end of the output, the rest is fetched by byte range.
+LOG_TAIL_BYTES = 64 * 1024
 
 app = Flask(__name__)
 
@@ -13,13 +16,35 @@ def index():
     return render_template("index.html", commands=commands)
 
 
-@app.route("/logs/<string:command_id>")
-def log(command_id: str):
+@app.route("/logs/<int:command_id>")
+def log(command_id: int):
     cron_db = CronDb("/tmp/test.db")
     log_obj = cron_db.select_log(command_id)
     if log_obj is None:
         return render_template("cannot_find_log.html", command_id=command_id)
-    return render_template("log.html", log_obj=log_obj)
+    sizes = {stream: cron_db.select_log_size(command_id, stream) for stream in LOG_STREAMS}
+    tails = {stream: cron_db.select_log_tail(command_id, stream, LOG_TAIL_BYTES).decode(errors="replace") for stream in LOG_STREAMS}
+    return render_template("log.html", log_obj=log_obj, sizes=sizes, tails=tails, tail_bytes=LOG_TAIL_BYTES)
+
+
+@app.route("/logs/<int:command_id>/<string:stream>")
+def log_range(command_id: int, stream: str):
+    """
+    Bytes `start..stop` of a command's output, the whole of it by default. Works while the command runs.
+    """
+    if stream not in LOG_STREAMS:
+        abort(404)
+    cron_db = CronDb("/tmp/test.db")
+    size = cron_db.select_log_size(command_id, stream)
+    start = max(request.args.get("start", 0, type=int), 0)
+    stop = min(request.args.get("stop", size, type=int), size)
+
+    def generate():
+        # one chunk at a time, so a large log is never held whole.
+        for offset in range(start, stop, LOG_CHUNK_BYTES):
+            yield cron_db.select_log_range(command_id, stream, offset, min(offset + LOG_CHUNK_BYTES, stop))
+
+    return Response(generate(), mimetype="text/plain")
 
 
 def run_server():
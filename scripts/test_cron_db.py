@@ -0,0 +1,49 @@
+import sqlite3
+import threading
+
+from cron_db import CommandStatus, CronDb
+
+
+def run_with_timeout(function, timeout: float = 10):
+    thread = threading.Thread(target=function, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), f"{function.__name__} did not return"
+
+
+def command_statuses(database_path: str):
+    connection = sqlite3.connect(database_path)
+    return dict(connection.execute('SELECT "command", "command_status" FROM "commands";').fetchall())
+
+
+def test_failed_write_keeps_the_rest_of_the_batch(tmp_path):
+    database_path = str(tmp_path / "cron.db")
+    cron_db = CronDb(database_path, write_behind=True)
+    cron_db.init()
+
+    cmds, _ = cron_db.insert_commands(["a", "b"])
+    cron_db.write([('INSERT INTO "missing" VALUES (?);', (1,), False)])
+    cron_db.update_command_completed(cmds[1][0])
+
+    run_with_timeout(cron_db.flush)
+    assert command_statuses(database_path) == {"a": CommandStatus.Created.value, "b": CommandStatus.Completed.value}
+
+    cron_db.write([('INSERT INTO "missing" VALUES (?);', (2,), False)])
+    cron_db.update_command_completed(cmds[0][0])
+    run_with_timeout(cron_db.close)
+    assert command_statuses(database_path) == {"a": CommandStatus.Completed.value, "b": CommandStatus.Completed.value}
+
+
+def test_writes_after_the_writer_stopped_are_not_lost(tmp_path):
+    database_path = str(tmp_path / "cron.db")
+    cron_db = CronDb(database_path, write_behind=True)
+    cron_db.init()
+    cmds, _ = cron_db.insert_commands(["a"])
+
+    cron_db.queue.put(None)
+    cron_db.writer.join()
+    cron_db.update_command_completed(cmds[0][0])
+
+    run_with_timeout(cron_db.flush)
+    assert command_statuses(database_path) == {"a": CommandStatus.Completed.value}
+    run_with_timeout(cron_db.close)
@@ -0,0 +1,25 @@
+import threading
+import time
+
+import groundblock
+from cron_db import CronDb
+
+
+def test_output_of_a_silent_command_is_stored_while_it_runs(tmp_path, monkeypatch):
+    monkeypatch.setattr(groundblock, "LOG_FLUSH_SECONDS", 0.2)
+    cron_db = CronDb(str(tmp_path / "cron.db"))
+    cron_db.init()
+    cmds, _ = cron_db.insert_commands(["echo started; sleep 3; echo done"])
+    command_id, cmd = cmds[0]
+
+    return_codes = []
+    thread = threading.Thread(target=lambda: return_codes.append(groundblock.run_command(cron_db, command_id, cmd)))
+    thread.start()
+    time.sleep(1)
+    assert thread.is_alive()
+    assert cron_db.select_log_tail(command_id, "stdout", 100) == b"started\n"
+
+    thread.join()
+    assert return_codes == [0]
+    assert cron_db.select_log_tail(command_id, "stdout", 100) == b"started\ndone\n"
+    assert cron_db.select_log_size(command_id, "stderr") == 0